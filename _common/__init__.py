@@ -6,10 +6,14 @@
 #
 #  MIT License
 
+import io
+import os
 import sys
+import mmap
+import stat
 import logging
 from argparse import Namespace, ArgumentParser
-from typing import TextIO, Union, BinaryIO, Optional
+from typing import TextIO, Union, BinaryIO, Optional, Iterator, Tuple
 
 
 _log = logging.getLogger(__name__)
@@ -63,20 +67,24 @@ class NullTerminatedInput(object):
     """An iterator over null-terminated lines (terminated by '\0') in
     a file. File must be opened before construction and should be
     closed by the caller afterward.
+
+    Text streams yield str lines. Binary streams yield lines decoded
+    with the filesystem encoding, or bytes if decode is false. Regular
+    binary files are memory-mapped and lines are decoded directly from
+    the mapping; other streams are read in large blocks, and each block
+    is split at null characters in one pass, so the cost per line does
+    not depend on how many blocks a line spans.
     """
-    # members
-    #    log = logging.getLogger('ntinput')
-    sizehint = 8 * 1024  # 8k
+    sizehint = 1024 * 1024  # 1M
     ifile = None
-    buff = ''
 
-    def __init__(self, ifile: TextIO=sys.stdin):
+    def __init__(self, ifile: Union[TextIO, BinaryIO]=sys.stdin, decode: bool=True):
         """Constructs the object to iterate over null-terminated lines
         in the input file argument.
         """
         self.ifile = ifile
-
-    #        self.log.debug(" initialized with file object: %s",  str(self.ifile))
+        self.decode = decode
+        self._lines = None
 
     def __iter__(self):
         return self
@@ -84,43 +92,83 @@ class NullTerminatedInput(object):
     def readlines(self):
         """Read all lines in the input file and return them as a sequence.
         """
-        lines = list()
-        for line in self:
-            lines.append(line)
-        return lines
+        return list(self)
+
+    def _is_binary(self) -> bool:
+        return isinstance(self.ifile, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(self.ifile, 'mode', '')
+
+    def _map(self) -> Optional[Tuple[mmap.mmap, int]]:
+        """Return a read-only mapping of the input file and the current position
+        in it, or None if the input is not a nonempty regular file."""
+        try:
+            fileno = self.ifile.fileno()
+            st = os.fstat(fileno)
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                return None
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), self.ifile.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def _iter_lines(self) -> Iterator[Union[str, bytes]]:
+        if not self._is_binary():
+            if not self.decode:
+                raise ValueError("undecoded output requires a binary stream")
+            yield from self._split_blocks(NULLCHAR)
+            return
+        encoding = sys.getfilesystemencoding()
+        mapped = self._map()
+        if mapped is not None:
+            yield from self._split_mapped(*mapped, encoding=encoding)
+        elif self.decode:
+            for line in self._split_blocks(NULLCHAR.encode('ascii')):
+                yield line.decode(encoding, 'surrogateescape')
+        else:
+            yield from self._split_blocks(NULLCHAR.encode('ascii'))
+
+    def _split_mapped(self, mapping: mmap.mmap, start: int, encoding: str) -> Iterator[Union[str, bytes]]:
+        terminator = NULLCHAR.encode('ascii')
+        with mapping:
+            view = memoryview(mapping)
+            try:
+                end = len(mapping)
+                while start < end:
+                    stop = mapping.find(terminator, start)
+                    if stop < 0:
+                        stop = end
+                    record = view[start:stop]
+                    line = str(record, encoding, 'surrogateescape') if self.decode else record.tobytes()
+                    record.release()
+                    start = stop + 1
+                    yield line
+                self.ifile.seek(end)
+            finally:
+                view.release()
+
+    def _split_blocks(self, terminator):
+        partial = []
+        while True:
+            block = self.ifile.read(self.sizehint)
+            if not block:
+                break
+            lines = block.split(terminator)
+            if len(lines) == 1:
+                partial.append(block)
+                continue
+            if partial:
+                partial.append(lines[0])
+                lines[0] = block[:0].join(partial)
+            # the last piece is the start of a line that is terminated in a later block, if at all
+            partial = [lines.pop()]
+            yield from lines
+        if partial:
+            tail = partial[0][:0].join(partial)
+            if tail:
+                yield tail
 
     def __next__(self):
-        busplitpt = self.buff.find(NULLCHAR)
-        #        self.log.debug(" current buff split point: %d", busplitpt)
-        if busplitpt >= 0:  # then buff contains a null-term char
-            nextstr = self.buff[:busplitpt]
-            self.buff = self.buff[busplitpt + 1:]
-            #            self.log.debug(" len(buff) now %d; returning str with len=%d", len(self.buff), len(nextstr))
-            return nextstr
-        # invariant: buff contains no null-term chars
-        my_bytes = ''
-        bysplitpt = -1
-        while bysplitpt < 0:
-            my_bytes = self.ifile.read(self.sizehint)
-            #            self.log.debug(" read %d bytes from file",  len(bytes))
-            if len(my_bytes) == 0:
-                break  # ...and return what's in buff, or if len(buff)==0 then StopIteration
-            self.buff += my_bytes  # implied else: len(bytes) > 0
-            bysplitpt = my_bytes.find(NULLCHAR)
-        #            self.log.debug(" bysplitpt=%d; len(buff)=%d",  bysplitpt,  len(self.buff))
-        # invariant: (bysplitpt >= 0 and len(bytes) > 0) or (len(bytes)==0)
-        #        self.log.debug(" post-loop: bysplitpt=%d, len(bytes)=%d",  bysplitpt,  len(bytes))
-        if len(my_bytes) == 0:
-            if len(self.buff) == 0:
-                raise StopIteration()
-            else:
-                return self.buff
-        # invariant: bysplitpt >= 0 and len(my_bytes) > 0
-        prevbufflen = len(self.buff) - len(my_bytes)
-        nextstr = self.buff[:prevbufflen + bysplitpt]
-        self.buff = self.buff[prevbufflen + bysplitpt + 1:]
-        #        self.log.debug(" returning str with len=%d; len(buff)=%d",  len(nextstr),  len(self.buff))
-        return nextstr
+        if self._lines is None:
+            self._lines = self._iter_lines()
+        return next(self._lines)
 
 
 class StreamContext(object):
@@ -131,10 +179,10 @@ class StreamContext(object):
         self.opened_input = None
 
     def get_standard_stream(self):
-        if 'w' in self.flags:
-            return sys.stdout
-        else:
-            return sys.stdin
+        stream = sys.stdout if 'w' in self.flags else sys.stdin
+        if 'b' in self.flags:
+            return stream.buffer
+        return stream
 
     def __enter__(self):
         if self.input_source is None or self.input_source == '-':
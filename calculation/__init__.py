@@ -1,5 +1,6 @@
 from typing import Callable, TextIO, List, Any, Pattern, Dict, Sequence, Tuple, Optional
 import csv
+import random
 import logging
 
 _log = logging.getLogger(__name__)
@@ -81,3 +82,32 @@ def build_parse_value(value_type: type, invert: bool) -> Callable[[str], Any]:
     return value_type
 
 
+def multiselect(values: List[Any], ranks: Sequence[int], rng: random.Random=None) -> Dict[int, Any]:
+    """Find the values that would be at certain indexes of the sorted list without sorting it.
+    The list is partitioned in place around random pivots, descending only into the
+    partitions that contain requested ranks, so the expected cost is O(n log k) for k ranks."""
+    rng = rng or random.Random(0)
+    selected = {}
+    stack = [(0, len(values), sorted(set(ranks)))]
+    while stack:
+        lo, hi, wanted = stack.pop()
+        if not wanted:
+            continue
+        if hi - lo <= 16:
+            chunk = sorted(values[lo:hi])
+            for r in wanted:
+                selected[r] = chunk[r - lo]
+            continue
+        pivot = values[rng.randrange(lo, hi)]
+        segment = values[lo:hi]
+        less = [v for v in segment if v < pivot]
+        equal_count = sum(1 for v in segment if v == pivot)
+        greater = [v for v in segment if v > pivot]
+        values[lo:hi] = less + [pivot] * equal_count + greater
+        lt_end, eq_end = lo + len(less), lo + len(less) + equal_count
+        for r in wanted:
+            if lt_end <= r < eq_end:
+                selected[r] = pivot
+        stack.append((lo, lt_end, [r for r in wanted if r < lt_end]))
+        stack.append((eq_end, hi, [r for r in wanted if r >= eq_end]))
+    return selected
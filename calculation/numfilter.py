@@ -7,22 +7,41 @@ import re
 import os
 import sys
 import json
+import io
+import array
+import bisect
 import errno
+import contextlib
+import heapq
+import math
+import operator
+import locale
+import mmap
+import struct
+import shutil
+import tempfile
+import multiprocessing
+import functools
+import itertools
 import logging
 import _common
 import calculation
 from _common import StreamContext
-from typing import Callable, TextIO, List, Any, Pattern, Dict, Sequence, Tuple, Optional, Union, Iterable, Iterator
+from typing import Callable, TextIO, BinaryIO, List, Any, Pattern, Dict, Sequence, Tuple, Optional, Union, Iterable, Iterator
 from argparse import ArgumentParser, Namespace
 from . import ValueParser, Ignorer
 
 
 _log = logging.getLogger(__name__)
+_SPLIT_BUFFER_SIZE = 1024 * 1024
 
 
 class Filter(object):
 
     def __init__(self, reference: float, operator: str, epsilon: float=None):
+        self.reference = reference
+        self.operator = operator
+        self.epsilon = epsilon
         self.callable = {
             'ge': lambda x: x >= reference,
             'gt': lambda x: x > reference,
@@ -35,6 +54,9 @@ class Filter(object):
     def __call__(self, query):
         return self.callable(query)
 
+    def __reduce__(self):
+        return Filter, (self.reference, self.operator, self.epsilon)
+
     @classmethod
     def from_args(cls, args: Namespace):
         reference = 0 if args.threshold is None else args.threshold
@@ -47,27 +69,660 @@ def _transform_value(value_str: str):
     return float(value_str)
 
 
+_TOKEN_PATTERN = re.compile(r'\s*(?:(c\d+)|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|inf|nan)|(>=|<=|==|!=|>|<)|(and|or|not)\b|([()]))')
+_COMPARATORS = {
+    '>=': 'ge',
+    '>': 'gt',
+    '<=': 'le',
+    '<': 'lt',
+    '==': 'eq',
+    '!=': 'ne',
+}
+
+
+class ExpressionSyntaxError(ValueError):
+    pass
+
+
+class Expression(object):
+
+    """Row predicate compiled from a boolean expression over column values.
+
+    Columns are referenced as cK, where K is a zero-based column index, and compared
+    to numbers or to other columns with >=, >, <=, <, == or !=. Comparisons may be
+    combined with 'and', 'or', 'not', and parentheses, as in
+    'c3 >= 0.5 and (c7 < 10 or c2 != 0)'. The expression is parsed once, and a
+    column value is converted only when its comparison is evaluated."""
+
+    def __init__(self, text: str, epsilon: float=None):
+        self.text = text
+        self.epsilon = 0 if epsilon is None else epsilon
+        self._tokens = self._tokenize(text)
+        self._position = 0
+        evaluate = self._parse_or()
+        if self._position < len(self._tokens):
+            raise ExpressionSyntaxError(f"unexpected token {self._tokens[self._position][1]!r} in expression")
+        self.callable = lambda row: evaluate(row, {})
+
+    def __call__(self, row: Sequence[str]) -> bool:
+        return self.callable(row)
+
+    def __reduce__(self):
+        return Expression, (self.text, self.epsilon)
+
+    @staticmethod
+    def _tokenize(text: str) -> List[Tuple[str, str]]:
+        tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            m = _TOKEN_PATTERN.match(text, position)
+            if m is None:
+                raise ExpressionSyntaxError(f"invalid expression syntax at position {position}: {text[position:]!r}")
+            kind = ('column', 'number', 'comparator', 'keyword', 'paren')[m.lastindex - 1]
+            tokens.append((kind, m.group(m.lastindex)))
+            position = m.end()
+        return tokens
+
+    def _peek(self) -> Tuple[Optional[str], Optional[str]]:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None, None
+
+    def _take(self, kind: str=None, value: str=None) -> str:
+        actual_kind, actual_value = self._peek()
+        if actual_kind is None:
+            raise ExpressionSyntaxError("unexpected end of expression")
+        if (kind is not None and actual_kind != kind) or (value is not None and actual_value != value):
+            raise ExpressionSyntaxError(f"unexpected token {actual_value!r} in expression")
+        self._position += 1
+        return actual_value
+
+    def _parse_or(self) -> Callable:
+        operands = [self._parse_and()]
+        while self._peek() == ('keyword', 'or'):
+            self._take()
+            operands.append(self._parse_and())
+        return functools.reduce(lambda f, g: lambda row, cache: f(row, cache) or g(row, cache), operands)
+
+    def _parse_and(self) -> Callable:
+        operands = [self._parse_not()]
+        while self._peek() == ('keyword', 'and'):
+            self._take()
+            operands.append(self._parse_not())
+        return functools.reduce(lambda f, g: lambda row, cache: f(row, cache) and g(row, cache), operands)
+
+    def _parse_not(self) -> Callable:
+        if self._peek() == ('keyword', 'not'):
+            self._take()
+            operand = self._parse_not()
+            return lambda row, cache: not operand(row, cache)
+        if self._peek() == ('paren', '('):
+            self._take()
+            inner = self._parse_or()
+            self._take('paren', ')')
+            return inner
+        return self._parse_comparison()
+
+    def _parse_operand(self) -> Callable:
+        kind, token = self._peek()
+        if kind == 'number':
+            self._take()
+            constant = float(token)
+            return lambda row, cache: constant
+        if kind == 'column':
+            self._take()
+            return _make_column_getter(int(token[1:]))
+        if kind is None:
+            raise ExpressionSyntaxError("unexpected end of expression")
+        raise ExpressionSyntaxError(f"expected column or number but found {token!r}")
+
+    def _parse_comparison(self) -> Callable:
+        left = self._parse_operand()
+        operator = _COMPARATORS[self._take('comparator')]
+        right = self._parse_operand()
+        epsilon = self.epsilon
+        return {
+            'ge': lambda row, cache: left(row, cache) >= right(row, cache),
+            'gt': lambda row, cache: left(row, cache) > right(row, cache),
+            'le': lambda row, cache: left(row, cache) <= right(row, cache),
+            'lt': lambda row, cache: left(row, cache) < right(row, cache),
+            'eq': lambda row, cache: abs(left(row, cache) - right(row, cache)) <= epsilon,
+            'ne': lambda row, cache: abs(left(row, cache) - right(row, cache)) > epsilon,
+        }[operator]
+
+
+def _make_column_getter(column: int) -> Callable:
+    def get_value(row, cache):
+        try:
+            return cache[column]
+        except KeyError:
+            value = _transform_value(row[column])
+            cache[column] = value
+            return value
+    return get_value
+
+
+class ColumnFilter(object):
+
+    """Row predicate that applies a value filter to the value in one column."""
+
+    def __init__(self, filterer: Callable[[float], bool], value_column: int=0):
+        self.filterer = filterer
+        self.value_column = value_column
+
+    def __call__(self, row: Sequence[str]) -> bool:
+        return self.filterer(_transform_value(row[self.value_column]))
+
+
 def do_filter(ifile: TextIO, filterer: Filter, ofile: TextIO, value_column=0, input_delimiter=',', output_delimiter=',', error_reaction='auto'):
-    output = csv.writer(ofile, delimiter=output_delimiter)
+    return filter_rows(ifile, ColumnFilter(filterer, value_column), ofile, input_delimiter, output_delimiter, error_reaction)
+
+
+def filter_rows(ifile: TextIO, row_predicate: Callable[[Sequence[str]], bool], ofile: TextIO, input_delimiter=',', output_delimiter=',', error_reaction='auto'):
+    nrows, nerrors = _filter_rows(ifile, row_predicate, ofile, input_delimiter, output_delimiter, error_reaction)
+    return _report(nrows, nerrors)
+
+
+def _report(nrows: int, nerrors: int) -> int:
+    if nerrors > 0:
+        _log.info("%d errors encountered; use --log-level=DEBUG to view them", nerrors)
+    return 0 if (nerrors != nrows) else 2
+
+
+def _tee_lines(ifile: Iterable[str], lines: List[str]) -> Iterator[str]:
+    for line in ifile:
+        lines.append(line)
+        yield line
+
+
+class RecordWriter(object):
+
+    """Writes kept rows to an output stream. If the input and output delimiters are
+    the same, the original text of each record is written as-is instead of being
+    re-serialized by a CSV writer. Rows must be read with the reader returned by
+    the read method, and take must be called once for every row read."""
+
+    def __init__(self, ofile: TextIO, input_delimiter: str=',', output_delimiter: str=','):
+        self.ofile = ofile
+        self.input_delimiter = input_delimiter
+        self.passthrough = input_delimiter == output_delimiter
+        self._lines = []
+        self._writer = None if self.passthrough else csv.writer(ofile, delimiter=output_delimiter)
+
+    def read(self, ifile: TextIO) -> Iterator[List[str]]:
+        if self.passthrough:
+            ifile = _tee_lines(ifile, self._lines)
+        return csv.reader(ifile, delimiter=self.input_delimiter)
+
+    def take(self, row: List[str]) -> Union[str, List[str]]:
+        """Return what must be written to reproduce the row most recently read."""
+        if not self.passthrough:
+            return row
+        lines = self._lines
+        record = lines[0] if len(lines) == 1 else ''.join(lines)
+        lines.clear()
+        if record[-1:] not in ('\n', '\r'):
+            record += '\n'
+        return record
+
+    def write(self, record: Union[str, List[str]]):
+        if self.passthrough:
+            self.ofile.write(record)
+        else:
+            self._writer.writerow(record)
+
+    def write_all(self, records: Iterable[Union[str, List[str]]]):
+        if self.passthrough:
+            self.ofile.writelines(records)
+        else:
+            self._writer.writerows(records)
+
+
+def _filter_rows(ifile: TextIO, row_predicate: Callable[[Sequence[str]], bool], ofile: TextIO, input_delimiter=',', output_delimiter=',', error_reaction='auto') -> Tuple[int, int]:
+    output = RecordWriter(ofile, input_delimiter, output_delimiter)
     nrows, nerrors = 0, 0
+    for row in output.read(ifile):
+        record = output.take(row)
+        nrows += 1
+        try:
+            keep = row_predicate(row)
+        except Exception as e:
+            _log.debug("failed to parse value on row %s due to: %s", nrows, e)
+            nerrors += 1
+            keep = error_reaction == 'include'
+        if keep:
+            output.write(record)
+    return nrows, nerrors
+
+
+def _parse_block_values(block: List[List[str]], value_column: int, numpy) -> Tuple[Any, Any]:
+    """Convert the value column of a block of rows to an array, returning the array
+    and a boolean array that marks rows whose value could not be parsed."""
+    try:
+        values = numpy.array([row[value_column] for row in block], dtype=numpy.float64)
+        return values, numpy.zeros(len(block), dtype=bool)
+    except (ValueError, IndexError):
+        pass
+    values = numpy.empty(len(block), dtype=numpy.float64)
+    errors = numpy.zeros(len(block), dtype=bool)
+    for i, row in enumerate(block):
+        try:
+            values[i] = _transform_value(row[value_column])
+        except Exception as e:
+            _log.debug("failed to parse value in block row %s due to: %s", i, e)
+            values[i] = 0
+            errors[i] = True
+    return values, errors
+
+
+def filter_blocks(ifile: TextIO, filterer: Filter, ofile: TextIO, value_column=0, block_size=10000, input_delimiter=',', output_delimiter=',', error_reaction='auto'):
+    """Filter rows like do_filter, but evaluate the filter on blocks of rows with NumPy.
+    The filter's comparison is applied to a whole array of values at once, and the
+    selected rows of each block are written in one batch."""
+    nrows, nerrors = _filter_blocks(ifile, filterer, ofile, value_column, block_size, input_delimiter, output_delimiter, error_reaction)
+    return _report(nrows, nerrors)
+
+
+def _filter_blocks(ifile: TextIO, filterer: Filter, ofile: TextIO, value_column=0, block_size=10000, input_delimiter=',', output_delimiter=',', error_reaction='auto') -> Tuple[int, int]:
+    import numpy
+    output = RecordWriter(ofile, input_delimiter, output_delimiter)
+    reader = output.read(ifile)
+    include_errors = error_reaction == 'include'
+    nrows, nerrors = 0, 0
+    while True:
+        block, records = [], []
+        for row in itertools.islice(reader, block_size):
+            block.append(row)
+            records.append(output.take(row))
+        if not block:
+            break
+        nrows += len(block)
+        values, errors = _parse_block_values(block, value_column, numpy)
+        mask = numpy.asarray(filterer(values), dtype=bool)
+        num_block_errors = int(numpy.count_nonzero(errors))
+        if num_block_errors > 0:
+            nerrors += num_block_errors
+            mask[errors] = include_errors
+        output.write_all(itertools.compress(records, mask.tolist()))
+    return nrows, nerrors
+
+
+def _quoted_field_end(data, quote: bytes, start: int, limit: int) -> int:
+    """Return the offset just past the quoted field that opens at start, following the
+    csv reader's rules: a doubled quote is an escaped quote, and any other quote ends
+    the field. A field that is never closed extends to limit."""
+    position = start + 1
+    while True:
+        close = data.find(quote, position, limit)
+        if close < 0:
+            return limit
+        if close + 1 < limit and data[close + 1] == quote[0]:
+            position = close + 2
+        else:
+            return close + 1
+
+
+def _opening_quote(data, quote: bytes, field_starts: bytes, start: int, stop: int) -> int:
+    """Return the offset of the first quote in [start, stop) that opens a quoted field,
+    or -1. A quote opens a field only at the start of a record or after a delimiter;
+    the start offset must not be inside a field that began with a quote."""
+    while True:
+        position = data.find(quote, start, stop)
+        if position <= 0 or data[position - 1] in field_starts:
+            return position
+        start = position + 1
+
+
+def iter_ranges(pathname: str, num_ranges: int, max_range_size: int=64 * 1024 * 1024,
+                delimiter: str=',', quotechar: str='"') -> Iterator[Tuple[int, int]]:
+    """Yield byte ranges of a file that each begin at the start of a record, as soon
+    as the end of each range is found. A line break ends a record only if it is not
+    in a quoted field, which is determined the way the csv reader does, so records
+    whose quoted fields contain line breaks are never split across ranges."""
+    size = os.path.getsize(pathname)
+    if size == 0:
+        return
+    range_size = max(1, min(max_range_size, -(-size // max(1, num_ranges))))
+    quote = quotechar.encode('utf-8')[:1]
+    field_starts = bytes([delimiter.encode('utf-8')[-1], ord("\n"), ord("\r")])
+    with open(pathname, 'rb') as ifile:
+        with mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            range_start, position = 0, 0  # position is never inside a quoted field
+            while range_start + range_size < size:
+                newline = data.find(b"\n", max(range_start + range_size - 1, position))
+                if newline < 0 or newline + 1 >= size:
+                    break
+                opening = _opening_quote(data, quote, field_starts, position, newline)
+                if opening >= 0:
+                    position = _quoted_field_end(data, quote, opening, size)
+                    continue
+                yield range_start, newline + 1
+                range_start = position = newline + 1
+    yield range_start, size
+
+
+def split_ranges(pathname: str, num_ranges: int, max_range_size: int=64 * 1024 * 1024,
+                 delimiter: str=',', quotechar: str='"') -> List[Tuple[int, int]]:
+    """Split a file into byte ranges that each begin at the start of a record."""
+    return list(iter_ranges(pathname, num_ranges, max_range_size, delimiter, quotechar))
+
+
+def _filter_range(task: Tuple[str, int, int, str, Callable]) -> Tuple[str, int, int]:
+    pathname, start, end, output_pathname, counter = task
+    with open(pathname, 'rb') as ifile:
+        ifile.seek(start)
+        data = ifile.read(end - start)
+    with io.TextIOWrapper(io.BytesIO(data)) as range_input:
+        with open(output_pathname, 'w', newline='', encoding='utf-8') as range_output:
+            nrows, nerrors = counter(range_input, ofile=range_output)
+    return output_pathname, nrows, nerrors
+
+
+def filter_parallel(pathname: str, counter: Callable, ofile: TextIO, jobs: int, input_delimiter: str=',') -> int:
+    """Filter a file in byte ranges that are processed concurrently in worker processes.
+    The counter is a picklable callable like _filter_rows, with all arguments except
+    the input and output streams already bound. Output is written in input order."""
+    nrows, nerrors, nranges = 0, 0, 0
+    with tempfile.TemporaryDirectory(prefix='numfilter') as tempdir:
+        # ranges are handed to the pool as they are found, so workers start filtering
+        # while the rest of the file is still being scanned for record boundaries
+        ranges = iter_ranges(pathname, jobs * 4, delimiter=input_delimiter)
+        tasks = ((pathname, start, end, os.path.join(tempdir, f"{i}.csv"), counter) for i, (start, end) in enumerate(ranges))
+        with multiprocessing.Pool(jobs) as pool:
+            for output_pathname, range_nrows, range_nerrors in pool.imap(_filter_range, tasks):
+                nranges += 1
+                nrows += range_nrows
+                nerrors += range_nerrors
+                with open(output_pathname, 'r', newline='', encoding='utf-8') as range_output:
+                    shutil.copyfileobj(range_output, ofile)
+                os.remove(output_pathname)
+    _log.debug("filtered %d byte ranges with %d workers", nranges, jobs)
+    return _report(nrows, nerrors)
+
+
+def _filter_extremes(ifile: TextIO, ofile: TextIO, value_column=0, count=10, largest=True, input_delimiter=',', output_delimiter=',', error_reaction='auto') -> Tuple[int, int]:
+    """Keep the rows with the largest (or smallest) values in one pass, holding at most
+    count rows in a heap. Kept rows are written in input order; among rows with equal
+    values, earlier rows are preferred."""
+    output = RecordWriter(ofile, input_delimiter, output_delimiter)
+    include_errors = error_reaction == 'include'
+    sign = 1 if largest else -1
+    heap, error_records = [], []
+    nrows, nerrors = 0, 0
+    for row in output.read(ifile):
+        record = output.take(row)
+        nrows += 1
+        try:
+            value = _transform_value(row[value_column])
+        except Exception as e:
+            _log.debug("failed to parse value on row %s due to: %s", nrows, e)
+            nerrors += 1
+            if include_errors:
+                error_records.append((nrows, record))
+            continue
+        if value != value or count <= 0:
+            continue
+        item = (sign * value, -nrows, record)
+        if len(heap) < count:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    kept = sorted([(-negative_index, record) for _, negative_index, record in heap] + error_records, key=operator.itemgetter(0))
+    output.write_all(map(operator.itemgetter(1), kept))
+    return nrows, nerrors
+
+
+def find_percentile(ifile: TextIO, percentile: float, value_column=0, input_delimiter=',') -> Optional[float]:
+    """Return the value at a percentile of the parseable values in a column, using
+    the nearest-rank definition, or None if there are no such values."""
+    values = []
     for row in csv.reader(ifile, delimiter=input_delimiter):
+        try:
+            value = _transform_value(row[value_column])
+        except Exception:
+            continue
+        if value == value:
+            values.append(value)
+    if not values:
+        return None
+    rank = min(len(values) - 1, max(0, math.ceil(percentile / 100 * len(values)) - 1))
+    return calculation.multiselect(values, [rank])[rank]
+
+
+def split_rows(ifile: TextIO, cuts: Sequence[float], ofiles: Sequence[TextIO], value_column=0, input_delimiter=',', output_delimiter=',') -> Tuple[int, int]:
+    """Route each row to one of len(cuts) + 1 outputs in a single pass. Output i
+    receives rows whose values are at least cuts[i - 1] and less than cuts[i]. Rows
+    whose values are unparseable or NaN are not written to any output."""
+    assert len(ofiles) == len(cuts) + 1, "expect one more output than cuts"
+    source = RecordWriter(ofiles[0], input_delimiter, output_delimiter)
+    writers = [RecordWriter(f, input_delimiter, output_delimiter) for f in ofiles]
+    writes = [w.write for w in writers]
+    nrows, nerrors = 0, 0
+    for row in source.read(ifile):
+        record = source.take(row)
         nrows += 1
-        parse_ok = False
         try:
             value = _transform_value(row[value_column])
-            parse_ok = True
-            if filterer(value):
-                output.writerow(row)
         except Exception as e:
             _log.debug("failed to parse value on row %s due to: %s", nrows, e)
-            if error_reaction == 'include' or (error_reaction == 'auto' and parse_ok):
-                output.writerow(row)
-    if nerrors > 0:
-        _log.info("%d errors encountered; use --log-level=DEBUG to view them", nerrors)
-    return 0 if (nerrors != nrows) else 2
+            nerrors += 1
+            continue
+        if value == value:
+            writes[bisect.bisect_right(cuts, value)](record)
+    return nrows, nerrors
+
+
+_INDEX_MAGIC = b'NFIDX001'
+_INDEX_HEADER = struct.Struct('<8sQqqqqi4s')
+
+
+def index_pathname(pathname: str, value_column: int) -> str:
+    return f"{pathname}.numfilter-{value_column}.idx"
+
 
+def _read_record_spans(ifile: BinaryIO, input_delimiter: str, encoding: str) -> Iterator[Tuple[List[str], int, int]]:
+    """Parse records from a binary stream, yielding each row with the byte offset and length of its record."""
+    lengths = []
+    def decoded_lines():
+        for line in ifile:
+            lengths.append(len(line))
+            yield line.decode(encoding)
+    offset = 0
+    for row in csv.reader(decoded_lines(), delimiter=input_delimiter):
+        length = lengths[0] if len(lengths) == 1 else sum(lengths)
+        lengths.clear()
+        yield row, offset, length
+        offset += length
 
 
+def build_index(pathname: str, value_column: int=0, input_delimiter: str=',') -> str:
+    """Build a sidecar index of the values in a column of a CSV file.
+
+    The index file contains a header followed by the parseable values of the column
+    in ascending order and the byte offsets and lengths of their records, plus the
+    offsets and lengths of the records whose values could not be parsed. Arrays
+    are stored in native machine format so that they can be memory-mapped."""
+    encoding = locale.getpreferredencoding(False)
+    stat = os.stat(pathname)
+    values, offsets, lengths = array.array('d'), array.array('q'), array.array('q')
+    error_offsets, error_lengths = array.array('q'), array.array('q')
+    nrows = 0
+    with open(pathname, 'rb') as ifile:
+        for row, offset, length in _read_record_spans(ifile, input_delimiter, encoding):
+            nrows += 1
+            try:
+                value = _transform_value(row[value_column])
+            except (ValueError, IndexError):
+                error_offsets.append(offset)
+                error_lengths.append(length)
+                continue
+            if value == value:  # NaN never satisfies a threshold
+                values.append(value)
+                offsets.append(offset)
+                lengths.append(length)
+    order = sorted(range(len(values)), key=values.__getitem__)
+    output_pathname = index_pathname(pathname, value_column)
+    with open(output_pathname, 'wb') as ofile:
+        ofile.write(_INDEX_HEADER.pack(_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, nrows, len(values), len(error_offsets),
+                                       value_column, input_delimiter.encode('utf-8')))
+        for a in (values, offsets, lengths):
+            array.array(a.typecode, map(a.__getitem__, order)).tofile(ofile)
+        error_offsets.tofile(ofile)
+        error_lengths.tofile(ofile)
+    _log.debug("indexed %d values of %d rows in %s", len(values), nrows, output_pathname)
+    return output_pathname
+
+
+def _partition_point(values: Sequence[float], predicate: Callable[[float], bool]) -> int:
+    """Return the first index of a sorted sequence at which a monotonic predicate is true."""
+    lo, hi = 0, len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if predicate(values[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class ValueIndex(object):
+
+    """Memory-mapped sidecar index built by build_index."""
+
+    def __init__(self, pathname: str):
+        self.pathname = pathname
+        self._ifile = open(pathname, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file cannot be mapped
+            self._ifile.close()
+            raise
+        if len(self._mmap) < _INDEX_HEADER.size:
+            self._mmap.close()
+            self._ifile.close()
+            raise ValueError("index file is truncated: " + pathname)
+        view = memoryview(self._mmap)
+        header = _INDEX_HEADER.unpack_from(view)
+        magic, self.source_size, self.source_mtime_ns, self.nrows, nentries, self.nerrors, self.value_column, delimiter = header
+        if magic != _INDEX_MAGIC:
+            view.release()
+            self.close()
+            raise ValueError("not a numfilter index: " + pathname)
+        self.input_delimiter = delimiter.rstrip(b"\0").decode('utf-8')
+        position = _INDEX_HEADER.size
+        self._views = [view]
+        def take(typecode, count):
+            nonlocal position
+            start, position = position, position + 8 * count
+            v = view[start:position].cast(typecode)
+            self._views.append(v)
+            return v
+        self.values, self.offsets, self.lengths = take('d', nentries), take('q', nentries), take('q', nentries)
+        self.error_offsets, self.error_lengths = take('q', self.nerrors), take('q', self.nerrors)
+
+    def is_fresh(self, source_pathname: str, value_column: int, input_delimiter: str) -> bool:
+        stat = os.stat(source_pathname)
+        return (self.source_size, self.source_mtime_ns, self.value_column, self.input_delimiter) == \
+               (stat.st_size, stat.st_mtime_ns, value_column, input_delimiter)
+
+    def select(self, filterer: Filter) -> List[range]:
+        """Return ranges of index entries whose values satisfy a threshold filter."""
+        n = len(self.values)
+        if filterer.operator in ('ge', 'gt'):
+            return [range(_partition_point(self.values, filterer), n)]
+        if filterer.operator in ('le', 'lt'):
+            return [range(0, _partition_point(self.values, lambda v: not filterer(v)))]
+        reference = filterer.reference
+        within = Filter(reference, 'eq', filterer.epsilon)
+        lo = _partition_point(self.values, lambda v: v >= reference or within(v))
+        hi = _partition_point(self.values, lambda v: v > reference and not within(v))
+        if filterer.operator == 'eq':
+            return [range(lo, hi)]
+        return [range(0, lo), range(hi, n)]
+
+    def close(self):
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._mmap.close()
+        self._ifile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def open_index(pathname: str, value_column: int, input_delimiter: str) -> Optional[ValueIndex]:
+    """Open the sidecar index for a column of a file, or return None if it is missing or out of date."""
+    idx_pathname = index_pathname(pathname, value_column)
+    if not os.path.isfile(idx_pathname):
+        return None
+    try:
+        index = ValueIndex(idx_pathname)
+    except ValueError as e:
+        _log.warning("ignoring unreadable index %s: %s", idx_pathname, e)
+        return None
+    if not index.is_fresh(pathname, value_column, input_delimiter):
+        _log.info("ignoring out-of-date index %s; rebuild it with --build-index", idx_pathname)
+        index.close()
+        return None
+    return index
+
+
+def filter_indexed(pathname: str, index: ValueIndex, filterer: Filter, ofile: TextIO, input_delimiter=',', output_delimiter=',', error_reaction='auto') -> int:
+    """Filter a file by reading only the records that its index selects, in file order."""
+    spans = []
+    for entries in index.select(filterer):
+        spans.extend(zip(index.offsets[entries.start:entries.stop], index.lengths[entries.start:entries.stop]))
+    if error_reaction == 'include':
+        spans.extend(zip(index.error_offsets, index.error_lengths))
+    spans.sort()
+    _log.debug("index selected %d of %d rows", len(spans), index.nrows)
+    encoding = locale.getpreferredencoding(False)
+    output = RecordWriter(ofile, input_delimiter, output_delimiter)
+    with open(pathname, 'rb') as ifile:
+        for offset, length in spans:
+            ifile.seek(offset)
+            text = ifile.read(length).decode(encoding).replace("\r\n", "\n").replace("\r", "\n")
+            for row in output.read([text]):
+                output.write(output.take(row))
+    return _report(index.nrows, index.nerrors)
+
+
+def _main_split(parser: ArgumentParser, args: Namespace, input_delimiter: str, output_delimiter: str) -> int:
+    conflicts = [option for option, value in (('--threshold', args.threshold), ('--operator', args.operator),
+                                              ('--epsilon', args.epsilon), ('--expression', args.expression),
+                                              ('--top', args.top), ('--bottom', args.bottom),
+                                              ('--above-percentile', args.above_percentile),
+                                              ('--jobs', args.jobs), ('--block-size', args.block_size))
+                 if value is not None]
+    if conflicts:
+        parser.error(f"--split-at cannot be combined with {conflicts[0]}")
+    try:
+        cuts = [float(token) for token in args.split_at.split(',')]
+    except ValueError:
+        parser.error("--split-at must be a comma-delimited list of numbers")
+    if any(a >= b for a, b in zip(cuts[:-1], cuts[1:])):
+        parser.error("--split-at values must be in ascending order")
+    if args.output_pattern is None:
+        parser.error("--split-at requires --output-pattern")
+    try:
+        pathnames = [args.output_pattern % i for i in range(len(cuts) + 1)]
+    except (TypeError, ValueError):
+        parser.error("--output-pattern must contain one %d")
+    if len(set(pathnames)) != len(pathnames):
+        parser.error("--output-pattern must contain one %d")
+    if args.errors == 'include':
+        parser.error("--errors include is not supported with --split-at")
+    with contextlib.ExitStack() as stack:
+        ofiles = [stack.enter_context(open(pathname, 'w', buffering=_SPLIT_BUFFER_SIZE)) for pathname in pathnames]
+        ifile = stack.enter_context(StreamContext(args.input, 'r'))
+        nrows, nerrors = split_rows(ifile, cuts, ofiles, args.column, input_delimiter, output_delimiter)
+    return _report(nrows, nerrors)
+
 
 def main(argl=None, ofile=sys.stdout):
     parser = ArgumentParser(description="Filter rows from an input CSV by applying a threshold to a column.")
@@ -78,12 +733,89 @@ def main(argl=None, ofile=sys.stdout):
     parser.add_argument("--epsilon", "-e", type=float, metavar='E', help="tolerance for 'eq' and 'ne' operators")
     parser.add_argument("--input-delimiter", default=',', help="set input delimiter")
     parser.add_argument("--output-delimiter", default=',', help="set output delimiter")
-    parser.add_argument("--column", "-c", default=0, type=int, help="set value column")
+    parser.add_argument("--column", "-c", type=int, help="set value column; default is 0")
     parser.add_argument("--errors", choices=('exclude', 'include', 'auto'), help="set reaction to errors")
+    parser.add_argument("--top", type=int, metavar="K", help="keep the K rows with the largest values, in input order")
+    parser.add_argument("--bottom", type=int, metavar="K", help="keep the K rows with the smallest values, in input order")
+    parser.add_argument("--above-percentile", type=float, metavar="P", help="keep rows whose value is greater than the P-th percentile of values; input must be a file, and all values of the column are held in memory to find the percentile")
+    parser.add_argument("--split-at", metavar="CUTS", help="split rows into buckets at ascending comma-delimited values, reading input once; requires --output-pattern")
+    parser.add_argument("--output-pattern", metavar="PATTERN", help="pathname pattern of bucket files, such as out-%%d.csv, where %%d is the bucket index")
+    parser.add_argument("--build-index", type=int, metavar="COL", help="write a sorted index of the values in column COL next to the input file and exit; later threshold queries on COL use the index until the input file changes")
+    parser.add_argument("--jobs", "-j", type=int, metavar="N", help="filter input file in N worker processes")
+    parser.add_argument("--block-size", type=int, metavar="N", help="evaluate threshold on blocks of N rows at a time (requires numpy)")
+    parser.add_argument("--expression", "-x", metavar="EXPR", help="filter by expression such as 'c3 >= 0.5 and (c7 < 10 or c2 != 0)' instead of a single threshold")
     args = parser.parse_args(argl)
     _common.config_logging(args)
     input_delimiter = "\t" if args.input_delimiter is 'TAB' else args.input_delimiter
     output_delimiter = "\t" if args.output_delimiter is 'TAB' else args.output_delimiter
-    f = Filter.from_args(args)
+    input_is_file = args.input is not None and args.input != '-' and os.path.isfile(args.input)
+    if args.expression is not None:
+        conflicts = [option for option, value in (('--threshold', args.threshold), ('--operator', args.operator), ('--column', args.column)) if value is not None]
+        if conflicts:
+            parser.error(f"--expression cannot be combined with {conflicts[0]}; refer to columns in the expression instead")
+    if args.column is None:
+        args.column = 0
+    if args.build_index is not None:
+        if not input_is_file:
+            parser.error("--build-index requires an input file")
+        build_index(args.input, args.build_index, input_delimiter)
+        return 0
+    if args.split_at is not None:
+        return _main_split(parser, args, input_delimiter, output_delimiter)
+    ranking_options = [option for option, value in (('--top', args.top), ('--bottom', args.bottom), ('--above-percentile', args.above_percentile)) if value is not None]
+    if len(ranking_options) > 1 or (ranking_options and args.expression is not None):
+        parser.error(f"{ranking_options[0]} cannot be combined with other selection options")
+    if ranking_options and (args.threshold is not None or args.operator is not None):
+        parser.error(f"{ranking_options[0]} cannot be combined with --threshold or --operator")
+    if (args.top is not None or args.bottom is not None) and (args.jobs is not None or args.block_size is not None):
+        parser.error(f"{ranking_options[0]} cannot be combined with --jobs or --block-size")
+    if args.top is not None or args.bottom is not None:
+        largest = args.top is not None
+        with StreamContext(args.input, 'r') as ifile:
+            nrows, nerrors = _filter_extremes(ifile, ofile, args.column, args.top if largest else args.bottom, largest,
+                                              input_delimiter, output_delimiter, args.errors)
+        return _report(nrows, nerrors)
+    if args.above_percentile is not None:
+        if not input_is_file:
+            parser.error("--above-percentile requires an input file")
+        if not (0 <= args.above_percentile <= 100):
+            parser.error("percentile must be between 0 and 100")
+        with open(args.input, 'r') as ifile:
+            cutoff = find_percentile(ifile, args.above_percentile, args.column, input_delimiter)
+        _log.debug("percentile %s cutoff is %s", args.above_percentile, cutoff)
+        if cutoff is None:
+            cutoff = math.inf
+        args.threshold, args.operator = cutoff, 'gt'
+    if args.expression is None and input_is_file:
+        index = open_index(args.input, args.column, input_delimiter)
+        if index is not None:
+            with index:
+                return filter_indexed(args.input, index, Filter.from_args(args), ofile, input_delimiter, output_delimiter, args.errors)
+    if args.block_size is not None:
+        if args.expression is not None:
+            parser.error("--block-size is not supported with --expression")
+        if args.block_size < 1:
+            parser.error("block size must be positive")
+        try:
+            import numpy
+        except ImportError:
+            parser.error("numpy must be installed to use --block-size")
+        counter = functools.partial(_filter_blocks, filterer=Filter.from_args(args), value_column=args.column, block_size=args.block_size,
+                                    input_delimiter=input_delimiter, output_delimiter=output_delimiter, error_reaction=args.errors)
+    else:
+        if args.expression is not None:
+            try:
+                row_predicate = Expression(args.expression, args.epsilon)
+            except ExpressionSyntaxError as e:
+                parser.error(str(e))
+        else:
+            row_predicate = ColumnFilter(Filter.from_args(args), args.column)
+        counter = functools.partial(_filter_rows, row_predicate=row_predicate,
+                                    input_delimiter=input_delimiter, output_delimiter=output_delimiter, error_reaction=args.errors)
+    if args.jobs is not None and args.jobs > 1:
+        if input_is_file:
+            return filter_parallel(args.input, counter, ofile, args.jobs, input_delimiter)
+        _log.warning("input is not a regular file; filtering sequentially")
     with StreamContext(args.input, 'r') as ifile:
-        return do_filter(ifile, f, ofile, args.column, input_delimiter, output_delimiter, args.errors)
+        nrows, nerrors = counter(ifile, ofile=ofile)
+    return _report(nrows, nerrors)
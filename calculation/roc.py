@@ -59,10 +59,29 @@ def roc_transform(elements: Sequence[Element], threshold_domain: Iterable) -> Di
     return roc
 
 
-def decide_domain(values: Iterator[float], domain_size: int=None, epsilon=1e-5) -> Iterator[float]:
-    sorted_vals = sorted(values)
-    assert len(sorted_vals) > 0, "zero elements in input"
-    min_value, max_value = sorted_vals[0], sorted_vals[-1]
+def _min_max(values: Iterable[float]) -> Tuple[float, float]:
+    """Find the minimum and maximum of some values in a single pass."""
+    min_value, max_value = None, None
+    for v in values:
+        if min_value is None:
+            min_value, max_value = v, v
+        elif v < min_value:
+            min_value = v
+        elif v > max_value:
+            max_value = v
+    assert min_value is not None, "zero elements in input"
+    return min_value, max_value
+
+
+def decide_domain(values: Iterator[float], domain_size: int=None, epsilon=1e-5, mode: str='width') -> Iterator[float]:
+    """Decide the threshold domain for some values. In 'width' mode, thresholds are
+    spaced evenly between the minimum and maximum values; in 'quantile' mode, thresholds
+    are placed at evenly spaced quantiles of the values."""
+    if mode == 'quantile':
+        return _decide_quantile_domain(list(values), domain_size)
+    if mode != 'width':
+        raise ValueError("unsupported domain mode: " + repr(mode))
+    min_value, max_value = _min_max(values)
     width = max_value - min_value
     if width == 0:
         if domain_size is not None and domain_size != 1:
@@ -73,6 +92,17 @@ def decide_domain(values: Iterator[float], domain_size: int=None, epsilon=1e-5)
     return map(lambda i: min_value + (i * step), range(domain_size))
 
 
+def _decide_quantile_domain(values: List[float], domain_size: int=None) -> Iterator[float]:
+    assert len(values) > 0, "zero elements in input"
+    domain_size = 100 if domain_size is None else domain_size
+    ranks = [(i * len(values)) // domain_size for i in range(domain_size)]
+    selected = calculation.multiselect(values, ranks)
+    thresholds = sorted(set(selected.values()))
+    if len(thresholds) < domain_size:
+        _log.debug("%d of %d quantile thresholds are distinct", len(thresholds), domain_size)
+    return iter(thresholds)
+
+
 def _make_evaluator(value):
     return lambda threshold: value >= threshold
 
@@ -84,6 +114,7 @@ def main(argl: Sequence[str]=None, ofile: TextIO=sys.stdout) -> 0:
     parser.add_argument("--invert", action='store_true', help="invert input values")
     parser.add_argument("--domain", type=float, nargs=2, metavar=("MIN", "STEP"), help="threshold domain")
     parser.add_argument("--domain-size", "-n", type=int, default=100, metavar="N", help="threshold domain size")
+    parser.add_argument("--domain-mode", choices=('width', 'quantile'), default='width', help="space thresholds at equal width or at evenly spaced quantiles")
     _common.add_logging_options(parser)
     args = parser.parse_args(argl)
     _common.config_logging(args)
@@ -100,7 +131,7 @@ def main(argl: Sequence[str]=None, ofile: TextIO=sys.stdout) -> 0:
     negative_elements = Element.list(known_negatives, False)
     all_elements = positive_elements + negative_elements
     if args.domain is None:
-        threshold_domain = decide_domain(known_positives + known_negatives, args.domain_size)
+        threshold_domain = decide_domain(known_positives + known_negatives, args.domain_size, mode=args.domain_mode)
     else:
         t_min, t_step = args.domain
         threshold_domain = [t_min + i * t_step for i in range(args.domain_size)]
@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
 import sys
+import os
 import csv
+import struct
+import itertools
+import contextlib
+import heapq
+import multiprocessing
+import array
 import argparse
 import logging
 import _common
-from typing import TextIO, Callable, Any, Set, List, FrozenSet, Collection, Iterator, Iterable
+from typing import TextIO, BinaryIO, Callable, Any, List, FrozenSet, Collection, Iterator, Iterable, Tuple, Sequence
 
 
 _log = logging.getLogger(__name__)
@@ -39,17 +46,13 @@ class UndirectedAdjacencySetGraph(object):
 
     def __init__(self, edges: Iterable[UndirectedEdge]):
         self.edge_set = set(edges)
+        self.incident_edges = {}
+        for edge in self.edge_set:
+            for v in edge:
+                self.incident_edges.setdefault(v, []).append(edge)
 
     def vertexes(self) -> Iterator:
-        seen = set()
-        for edge in self.edges():
-            a, b = edge
-            if a not in seen:
-                seen.add(a)
-                yield a
-            if b not in seen:
-                seen.add(b)
-                yield b
+        return iter(self.incident_edges)
 
     def edges(self, edge_filter: Callable[[UndirectedEdge], bool]=None) -> Iterator[UndirectedEdge]:
         edge_filter = edge_filter or _ALWAYS_TRUE
@@ -57,22 +60,19 @@ class UndirectedAdjacencySetGraph(object):
 
     def neighbors(self, v) -> Iterator:
         """Return an iterable of neighbors of a vertex."""
-        return map(lambda edge: edge.other(v), self.edges(lambda edge: v in edge))
+        return map(lambda edge: edge.other(v), self.incident_edges.get(v, ()))
 
     def reachable_from(self, origin) -> Iterable:
         """Return a depth-first iterable of vertexes reachable from a given origin.
         Returned iterable does not include the origin."""
         accum = set()
-        return self._reachable_from(origin, origin, accum)
-
-    def _reachable_from(self, v, origin, accum: Set) -> Iterable:
-        to_do = []
-        for u in self.neighbors(v):
-            if u not in accum and u != origin:
-                accum.add(u)
-                to_do.append(u)
-        for u in to_do:
-            self._reachable_from(u, origin, accum)
+        to_do = [origin]
+        while to_do:
+            v = to_do.pop()
+            for u in self.neighbors(v):
+                if u not in accum and u != origin:
+                    accum.add(u)
+                    to_do.append(u)
         return accum
 
     def connected_subgraphs(self, include_trivial: bool=False) -> Iterator[FrozenSet]:
@@ -94,6 +94,134 @@ class UndirectedAdjacencySetGraph(object):
                 yield connecteds
 
 
+class LabelTable(object):
+
+    """Table that interns vertex labels as dense integer identifiers."""
+
+    def __init__(self):
+        self.ids = {}
+        self.labels = []
+
+    def intern(self, label) -> int:
+        """Return the identifier of a label, assigning the next identifier if the label is new."""
+        i = self.ids.get(label)
+        if i is None:
+            i = len(self.labels)
+            self.ids[label] = i
+            self.labels.append(label)
+        return i
+
+    def __getitem__(self, i: int):
+        return self.labels[i]
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class DisjointSet(object):
+
+    """Union-find structure with path compression and union by rank.
+
+    Vertex labels are interned as integer identifiers, and the parent, rank and size
+    of each identifier are kept in compact arrays. Methods with an _id suffix operate
+    on identifiers directly."""
+
+    def __init__(self, labels: LabelTable=None):
+        self.labels = labels if labels is not None else LabelTable()
+        self.parent = array.array('i')
+        self.rank = array.array('b')
+        self.size = array.array('q')
+        self._grow()
+
+    def _grow(self):
+        for i in range(len(self.parent), len(self.labels)):
+            self.parent.append(i)
+            self.rank.append(0)
+            self.size.append(1)
+
+    def add(self, v) -> int:
+        """Add a vertex if necessary and return its identifier."""
+        i = self.labels.intern(v)
+        if i >= len(self.parent):
+            self._grow()
+        return i
+
+    def find_id(self, i: int) -> int:
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def find(self, v):
+        """Return the representative of the set containing a vertex."""
+        return self.labels[self.find_id(self.labels.ids[v])]
+
+    def union_id(self, u: int, v: int) -> bool:
+        u, v = self.find_id(u), self.find_id(v)
+        if u == v:
+            return False
+        rank = self.rank
+        if rank[u] < rank[v]:
+            u, v = v, u
+        self.parent[v] = u
+        self.size[u] += self.size[v]
+        if rank[u] == rank[v]:
+            rank[u] += 1
+        return True
+
+    def union(self, u, v) -> bool:
+        """Merge the sets containing two vertexes, adding the vertexes if necessary.
+        Return true if the vertexes were in different sets."""
+        return self.union_id(self.add(u), self.add(v))
+
+    def update(self, pairs: Iterable[Tuple[Any, Any]]):
+        """Merge the sets containing the vertexes of each pair."""
+        intern, union_id = self.labels.intern, self.union_id
+        for u, v in pairs:
+            u, v = intern(u), intern(v)
+            if v >= len(self.parent) or u >= len(self.parent):
+                self._grow()
+            union_id(u, v)
+
+    def components(self) -> List[FrozenSet]:
+        """Return the vertex set of each disjoint set."""
+        members = {}
+        find_id, labels = self.find_id, self.labels.labels
+        for i in range(len(self.parent)):
+            members.setdefault(find_id(i), []).append(labels[i])
+        return [frozenset(vs) for vs in members.values()]
+
+
+class EdgeArrays(object):
+
+    """Weighted edges stored in parallel arrays of vertex identifiers and weights."""
+
+    def __init__(self, labels: LabelTable=None):
+        self.labels = labels if labels is not None else LabelTable()
+        self.u = array.array('i')
+        self.v = array.array('i')
+        self.weight = array.array('d')
+
+    def add(self, weight, u, v):
+        intern = self.labels.intern
+        self.u.append(intern(u))
+        self.v.append(intern(v))
+        self.weight.append(weight)
+
+    def extend(self, weighted_pairs: Iterable[Tuple[Any, Any, Any]]):
+        intern, u_ids, v_ids, weights = self.labels.intern, self.u, self.v, self.weight
+        for weight, u, v in weighted_pairs:
+            u_ids.append(intern(u))
+            v_ids.append(intern(v))
+            weights.append(weight)
+
+    def __len__(self):
+        return len(self.weight)
+
+
 class EdgeParser(object):
 
     def __init__(self, weight_col=0, u_col=1, v_col=2, parse_weight: Callable[[str], Any]=float):
@@ -102,6 +230,21 @@ class EdgeParser(object):
         self.v_col = v_col
         self.parse_weight = parse_weight
 
+    def iter_weighted_pairs(self, ifile: TextIO) -> Iterator[Tuple[Any, str, str]]:
+        """Yield the (weight, u, v) tuple of each edge."""
+        parse_weight, w_col, u_col, v_col = self.parse_weight, self.weight_col, self.u_col, self.v_col
+        for row in csv.reader(ifile):
+            yield parse_weight(row[w_col]), row[u_col], row[v_col]
+
+    def iter_pairs(self, ifile: TextIO, weight_filter: Callable[[Any], bool]=None) -> Iterator[Tuple[str, str]]:
+        """Yield the (u, v) vertex label pairs of edges whose weights pass a filter,
+        without constructing edge objects."""
+        weight_filter = weight_filter or _ALWAYS_TRUE
+        parse_weight, w_col, u_col, v_col = self.parse_weight, self.weight_col, self.u_col, self.v_col
+        for row in csv.reader(ifile):
+            if weight_filter(parse_weight(row[w_col])):
+                yield row[u_col], row[v_col]
+
     def parse_edges(self, ifile: TextIO) -> List[UndirectedEdge]:
         edges = []
         for row in csv.reader(ifile):
@@ -110,15 +253,203 @@ class EdgeParser(object):
         return edges
 
 
-def process(ifile: TextIO, edge_parser: EdgeParser, weight_filter: Callable[[Any], bool]) -> Iterator[FrozenSet]:
-    edges = edge_parser.parse_edges(ifile)
-    edge_filter = lambda e: weight_filter(e.weight)
-    graph = UndirectedAdjacencySetGraph(filter(edge_filter, edges))
-    return graph.connected_subgraphs()
+def process(ifile: TextIO, edge_parser: EdgeParser, weight_filter: Callable[[Any], bool], disjoint_set: DisjointSet=None) -> List[FrozenSet]:
+    """Find the connected subgraphs formed by edges whose weights pass a filter.
+    Edges are streamed into a disjoint set, so memory use is proportional to
+    the number of vertexes rather than the number of edges. If a disjoint set
+    is provided, the edges are added to the vertex sets it already contains."""
+    disjoint_set = disjoint_set if disjoint_set is not None else DisjointSet()
+    disjoint_set.update(edge_parser.iter_pairs(ifile, weight_filter))
+    return [c for c in disjoint_set.components() if len(c) >= 2]
+
+
+_STATE_MAGIC = b'CLSTATE1'
+_STATE_HEADER = struct.Struct('<8s2sdq')
+
+
+def save_state(disjoint_set: DisjointSet, ofile: BinaryIO, comparison: str, threshold: float):
+    """Write a disjoint set and the weight filter used to build it to a binary stream.
+    The parent, rank and size arrays are written as-is, followed by the byte length
+    of each label and the UTF-8 encoded labels."""
+    encoded = [label.encode('utf-8') for label in disjoint_set.labels.labels]
+    ofile.write(_STATE_HEADER.pack(_STATE_MAGIC, comparison.encode('ascii'), threshold, len(encoded)))
+    disjoint_set.parent.tofile(ofile)
+    disjoint_set.rank.tofile(ofile)
+    disjoint_set.size.tofile(ofile)
+    array.array('q', map(len, encoded)).tofile(ofile)
+    ofile.write(b''.join(encoded))
+
+
+def load_state(ifile: BinaryIO) -> Tuple[DisjointSet, str, float]:
+    """Read a disjoint set written by save_state, and the comparison and threshold
+    of the weight filter used to build it."""
+    header = ifile.read(_STATE_HEADER.size)
+    if len(header) < _STATE_HEADER.size:
+        raise ValueError("cluster state is truncated")
+    magic, comparison, threshold, n = _STATE_HEADER.unpack(header)
+    if magic != _STATE_MAGIC:
+        raise ValueError("not a cluster state file")
+    disjoint_set = DisjointSet()
+    try:
+        disjoint_set.parent.fromfile(ifile, n)
+        disjoint_set.rank.fromfile(ifile, n)
+        disjoint_set.size.fromfile(ifile, n)
+        lengths = array.array('q')
+        lengths.fromfile(ifile, n)
+    except EOFError:
+        raise ValueError("cluster state is truncated")
+    blob = ifile.read(sum(lengths))
+    labels, position = disjoint_set.labels, 0
+    for length in lengths:
+        labels.intern(blob[position:position + length].decode('utf-8'))
+        position += length
+    if len(labels) != n:
+        raise ValueError("cluster state contains duplicate labels")
+    return disjoint_set, comparison.decode('ascii'), threshold
+
+
+def _load_state(state_pathname: str, comparison: str, threshold: float) -> DisjointSet:
+    if not os.path.exists(state_pathname):
+        return DisjointSet()
+    with open(state_pathname, 'rb') as sfile:
+        disjoint_set, saved_comparison, saved_threshold = load_state(sfile)
+    if (saved_comparison, saved_threshold) != (comparison, threshold):
+        raise ValueError(f"state was built with comparison {saved_comparison} and threshold {saved_threshold}")
+    _log.debug("loaded %d vertexes from %s", len(disjoint_set.labels), state_pathname)
+    return disjoint_set
+
+
+def _save_state(state_pathname: str, disjoint_set: DisjointSet, comparison: str, threshold: float):
+    temp_pathname = state_pathname + '.tmp'
+    with open(temp_pathname, 'wb') as sfile:
+        save_state(disjoint_set, sfile, comparison, threshold)
+    os.replace(temp_pathname, state_pathname)
+
+
+def _shard_forest(task: Tuple[str, EdgeParser, str, float]) -> Tuple[List[str], array.array]:
+    """Build a disjoint set from the edges in one file and return its labels and the
+    root identifier of each label."""
+    pathname, edge_parser, comparison, threshold = task
+    disjoint_set = DisjointSet()
+    with open(pathname, 'r') as ifile:
+        disjoint_set.update(edge_parser.iter_pairs(ifile, make_weight_filter(comparison, threshold)))
+    roots = array.array('i', map(disjoint_set.find_id, range(len(disjoint_set.parent))))
+    return disjoint_set.labels.labels, roots
+
+
+def merge_forest(disjoint_set: DisjointSet, labels: Sequence[str], roots: Sequence[int]):
+    """Merge a partial forest, given as labels and the root identifier of each label, into a disjoint set."""
+    ids = [disjoint_set.add(label) for label in labels]
+    union_id = disjoint_set.union_id
+    for i, root in enumerate(roots):
+        if i != root:
+            union_id(ids[i], ids[root])
+
+
+def process_files(pathnames: Sequence[str], edge_parser: EdgeParser, comparison: str, threshold: float, jobs: int=None,
+                  disjoint_set: DisjointSet=None, ifile: TextIO=sys.stdin) -> List[FrozenSet]:
+    """Find connected subgraphs formed by edges in several files. Each file is parsed
+    in a worker process that builds a local disjoint set, and the partial forests
+    are merged in this process, so the result is the same as a sequential run.
+    A pathname of '-' stands for ifile, which is read in this process while the
+    workers parse the other files."""
+    disjoint_set = disjoint_set if disjoint_set is not None else DisjointSet()
+    tasks = [(pathname, edge_parser, comparison, threshold) for pathname in pathnames if pathname != '-']
+    with multiprocessing.Pool(jobs) as pool:
+        forests = pool.imap_unordered(_shard_forest, tasks)
+        if '-' in pathnames:
+            disjoint_set.update(edge_parser.iter_pairs(ifile, make_weight_filter(comparison, threshold)))
+        for labels, roots in forests:
+            merge_forest(disjoint_set, labels, roots)
+    return [c for c in disjoint_set.components() if len(c) >= 2]
+
+
+class Merge(tuple):
+
+    """Record of two clusters being joined by an edge during a threshold sweep."""
+
+    weight, u, v, u_size, v_size = None, None, None, 0, 0
+
+    def __new__(cls, weight, u, v, u_size: int, v_size: int):
+        instance = super(Merge, cls).__new__(cls, [weight, u, v, u_size, v_size])
+        instance.weight, instance.u, instance.v, instance.u_size, instance.v_size = weight, u, v, u_size, v_size
+        return instance
+
+
+def _sweep_descending(operator: str) -> bool:
+    if operator in ('ge', 'gt'):
+        return True
+    if operator in ('le', 'lt'):
+        return False
+    raise ValueError("threshold sweep requires one of ge, gt, le, lt operators")
+
+
+_EDGE_SORT_CHUNK_SIZE = 1 << 20
+
+
+def _edge_order(weights: array.array, reverse: bool=False) -> Iterable[int]:
+    """Return the edge indexes in order of weight, keeping edges of equal weight in
+    input order. The order is computed without creating an object per edge: with
+    numpy if it is available, otherwise by sorting chunks of indexes into compact
+    arrays and merging them lazily."""
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        values = numpy.frombuffer(weights, dtype=numpy.float64) if len(weights) else numpy.empty(0)
+        return numpy.argsort(-values if reverse else values, kind='stable')
+    chunks = []
+    for start in range(0, len(weights), _EDGE_SORT_CHUNK_SIZE):
+        chunk = sorted(range(start, min(len(weights), start + _EDGE_SORT_CHUNK_SIZE)), key=weights.__getitem__, reverse=reverse)
+        chunks.append(array.array('q', chunk))
+    if len(chunks) == 1:
+        return chunks[0]
+    # merging keeps ties in chunk order, and chunks are in input order, so the merge is stable
+    return heapq.merge(*chunks, key=weights.__getitem__, reverse=reverse)
+
+
+def single_linkage(weighted_pairs: Iterable[Tuple[Any, Any, Any]], operator: str='ge') -> List[Merge]:
+    """Join vertexes in order of edge weight, Kruskal-style, and return the merges
+    in the order they happen. Edges are taken strongest first, where the strongest
+    edge has the largest weight for the ge and gt operators and the smallest weight
+    for le and lt. The result is the single-linkage merge tree of the graph."""
+    edges = weighted_pairs if isinstance(weighted_pairs, EdgeArrays) else EdgeArrays()
+    if edges is not weighted_pairs:
+        edges.extend(weighted_pairs)
+    order = _edge_order(edges.weight, _sweep_descending(operator))
+    disjoint_set = DisjointSet(edges.labels)
+    labels, size = edges.labels, disjoint_set.size
+    merges = []
+    for k in order:
+        u, v = edges.u[k], edges.v[k]
+        u_root, v_root = disjoint_set.find_id(u), disjoint_set.find_id(v)
+        if u_root != v_root:
+            merges.append(Merge(edges.weight[k], labels[u], labels[v], size[u_root], size[v_root]))
+            disjoint_set.union_id(u_root, v_root)
+    return merges
+
+
+def sweep_thresholds(merges: Sequence[Merge], thresholds: Iterable[Any], operator: str='ge') -> List[Tuple[Any, int, int]]:
+    """Return (threshold, number of nontrivial clusters, largest cluster size) at each
+    threshold, computed from the merges produced by single_linkage."""
+    descending = _sweep_descending(operator)
+    ordered = sorted(set(thresholds), reverse=descending)
+    stats = {}
+    num_clusters, largest, i = 0, 0, 0
+    for threshold in ordered:
+        weight_filter = make_weight_filter(operator, threshold)
+        while i < len(merges) and weight_filter(merges[i].weight):
+            merge = merges[i]
+            num_clusters += 1 - (merge.u_size >= 2) - (merge.v_size >= 2)
+            largest = max(largest, merge.u_size + merge.v_size)
+            i += 1
+        stats[threshold] = (threshold, num_clusters, largest)
+    return [stats[threshold] for threshold in thresholds]
 
 
 def render_subgraphs(subgraphs: Iterable[Collection], min_size: int=None, max_print: int=10, ofile: TextIO=sys.stdout):
-    max_subgraph_size = max(map(len, subgraphs))
+    max_subgraph_size = max(map(len, subgraphs), default=0)
     subgraphs = sorted(subgraphs, key=len, reverse=True)
     _log.debug("%d connected subgraphs sastify criterion; max size = %d", len(subgraphs), max_subgraph_size)
     num_printed = 0
@@ -144,19 +475,59 @@ def make_weight_filter(operator: str, threshold: Any) -> Callable[[Any], bool]:
     }[operator]
 
 
-def main():
+def main(argl: Sequence[str]=None, ifile: TextIO=sys.stdin, ofile: TextIO=sys.stdout):
     parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs='*', metavar="FILE", help="edge CSV files; default is standard input")
+    parser.add_argument("-j", "--jobs", type=int, metavar="N", help="parse multiple input files in N worker processes; default is one per core")
     parser.add_argument("-t", "--threshold", type=float, default=0.0, help="set connectedness threshold")
-    parser.add_argument("-c", "--comparison", choices=('ge', 'gt', 'lt', 'le', 'eq'), help="operator to use when comparing weight to threshold")
+    parser.add_argument("-c", "--comparison", choices=('ge', 'gt', 'lt', 'le', 'eq'), default='ge', help="operator to use when comparing weight to threshold")
     _common.add_logging_options(parser)
     parser.add_argument("--weight-col", type=int, default=0)
     parser.add_argument("--label-cols", type=int, nargs=2, default=(1, 2), help="indexes of columns containing vertex labels")
     parser.add_argument("--max-print", type=int, default=10)
     parser.add_argument("--min-size", type=int, metavar="N", help="show all clusters of size at least N; default is to show only the largest cluster")
-    args = parser.parse_args()
+    parser.add_argument("--state", metavar="FILE", help="load cluster state from FILE if it exists, add the input edges, and save the state to FILE")
+    parser.add_argument("--sweep", metavar="THRESHOLDS", help="print the number of clusters and the largest cluster size at each of a comma-delimited list of thresholds")
+    parser.add_argument("--merge-tree", action='store_true', help="print the single-linkage merge tree as rows of weight, u, v, and the sizes of the merged clusters")
+    args = parser.parse_args(argl)
     _common.config_logging(args)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("number of jobs must be positive")
     edge_parser = EdgeParser(args.weight_col, args.label_cols[0], args.label_cols[1])
-    weight_filter = make_weight_filter(args.comparison, args.threshold)
-    subgraphs = process(sys.stdin, edge_parser, weight_filter)
-    render_subgraphs(subgraphs)
+    if args.sweep is not None or args.merge_tree:
+        if args.state is not None:
+            parser.error("--state cannot be combined with --sweep or --merge-tree")
+        if args.sweep is not None and args.merge_tree:
+            parser.error("--sweep and --merge-tree are mutually exclusive")
+        if args.comparison == 'eq':
+            parser.error("--sweep and --merge-tree require one of ge, gt, le, lt comparisons")
+        try:
+            thresholds = [float(token) for token in (args.sweep or '').split(',') if token.strip()]
+        except ValueError:
+            parser.error("--sweep must be a comma-delimited list of numbers")
+        with contextlib.ExitStack() as stack:
+            edge_files = [stack.enter_context(_common.StreamContext(ifile if source == '-' else source, 'r')) for source in (args.inputs or [ifile])]
+            merges = single_linkage(itertools.chain.from_iterable(map(edge_parser.iter_weighted_pairs, edge_files)), args.comparison)
+        writer = csv.writer(ofile)
+        if args.merge_tree:
+            writer.writerows(merges)
+        else:
+            writer.writerows(sweep_thresholds(merges, thresholds, args.comparison))
+        return 0
+    try:
+        disjoint_set = DisjointSet() if args.state is None else _load_state(args.state, args.comparison, args.threshold)
+    except ValueError as e:
+        print(f"clusters: {args.state}: {e}", file=sys.stderr)
+        return 1
+    if len(args.inputs) > 1 and (args.jobs is None or args.jobs > 1):
+        subgraphs = process_files(args.inputs, edge_parser, args.comparison, args.threshold, args.jobs, disjoint_set, ifile)
+    else:
+        weight_filter = make_weight_filter(args.comparison, args.threshold)
+        for source in [ifile if source == '-' else source for source in args.inputs] or [ifile]:
+            with _common.StreamContext(source, 'r') as edge_file:
+                disjoint_set.update(edge_parser.iter_pairs(edge_file, weight_filter))
+        subgraphs = [c for c in disjoint_set.components() if len(c) >= 2]
+    if args.state is not None:
+        _save_state(args.state, disjoint_set, args.comparison, args.threshold)
+    render_subgraphs(subgraphs, ofile=ofile)
     return 0
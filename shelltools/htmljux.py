@@ -7,16 +7,31 @@ are parsed from a CSV file.
 
 from __future__ import print_function
 import urllib.parse
+import multiprocessing
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import heapq
+import itertools
+import locale
+import socketserver
+import http.server
+import mimetypes
+import shutil
+import threading
 import operator
 import logging
 import pathlib
 import os.path
 import jinja2
+import json
 import math
 import sys
 import csv
 import re
 import os
+from array import array
 from typing import Iterable, List, TextIO, Dict, Optional, Callable, Sequence, Tuple, Iterator
 from argparse import ArgumentParser, Namespace
 from _common import predicates, redaction
@@ -50,13 +65,20 @@ DEFAULT_TEMPLATE = """<!DOCTYPE html>
         </style>
     </head>
     <body>
+    {% if page %}
+    <div class="pages">
+        {% if page.prev_url %}<a href="{{ page.prev_url }}">previous</a>{% endif %}
+        <a href="{{ page.index_url }}">page {{ page.number }}</a>
+        {% if page.next_url %}<a href="{{ page.next_url }}">next</a>{% endif %}
+    </div>
+    {% endif %}
     <div>
         {% for row in rows %}
         <div class="row">
             <div class="images">
                 {% for image in row.images %}
                 <div class="image">
-                    <img src="{{image.url}}">
+                    {% if image.link_url %}<a href="{{image.link_url}}">{% endif %}<img src="{{image.url}}"{% if image.width %} width="{{image.width}}" height="{{image.height}}"{% endif %}>{% if image.link_url %}</a>{% endif %}
                     <div class="image-title">{{image.title}}</div>
                 </div>
                 {% endfor %}
@@ -71,11 +93,155 @@ DEFAULT_TEMPLATE = """<!DOCTYPE html>
 </html>
 """
 
+INDEX_TEMPLATE = """<!DOCTYPE html>
+<html>
+    <head>
+        <style>
+{{ css }}
+        </style>
+    </head>
+    <body>
+    <ul>
+        {% for page in pages %}
+        <li><a href="{{ page.url }}">page {{ page.number }}</a> (rows {{ page.first_row }} to {{ page.last_row }})</li>
+        {% endfor %}
+    </ul>
+    </body>
+</html>
+"""
+VIRTUAL_TEMPLATE = """<!DOCTYPE html>
+<html>
+    <head>
+        <style>
+body {
+    margin: 0;
+}
+
+#viewport {
+    height: 100vh;
+    overflow-y: auto;
+    position: relative;
+}
+
+#visible {
+    position: absolute;
+    top: 0;
+    left: 0;
+    right: 0;
+}
+
+.row {
+    box-sizing: border-box;
+    height: {{ row_height }}px;
+    overflow: hidden;
+    padding: 15px;
+}
+
+.image {
+    margin: 5px;
+    display: inline-block;
+    text-align: center;
+}
+
+.image img {
+    max-height: calc({{ row_height }}px - 4em);
+}
+
+.caption {
+    float: left;
+}
+{{ css }}
+        </style>
+    </head>
+    <body>
+    <div id="viewport"><div id="spacer"></div><div id="visible"></div></div>
+    <script id="rows" type="application/json">{% for chunk in rows_json %}{{ chunk|safe }}{% endfor %}</script>
+    <script>
+(function () {
+    var data = document.getElementById("rows");
+    var rows = JSON.parse(data.textContent);
+    data.remove();
+    var rowHeight = {{ row_height }}, overscan = 4;
+    var viewport = document.getElementById("viewport");
+    var visible = document.getElementById("visible");
+    var first = -1, last = -1, scheduled = false;
+    document.getElementById("spacer").style.height = (rows.length * rowHeight) + "px";
+    function element(tag, className, text) {
+        var e = document.createElement(tag);
+        if (className) e.className = className;
+        if (text !== undefined) e.textContent = text;
+        return e;
+    }
+    function renderRow(row) {
+        var div = element("div", "row"), images = element("div", "images");
+        row[1].forEach(function (image) {
+            var container = element("div", "image"), img = element("img"), parent = container;
+            img.loading = "lazy";
+            img.src = image[0];
+            if (image[3]) {
+                img.width = image[3];
+                img.height = image[4];
+            }
+            if (image[2]) {
+                parent = element("a");
+                parent.href = image[2];
+                container.appendChild(parent);
+            }
+            parent.appendChild(img);
+            container.appendChild(element("div", "image-title", image[1]));
+            images.appendChild(container);
+        });
+        div.appendChild(images);
+        div.appendChild(element("div", "caption", row[0]));
+        return div;
+    }
+    function update() {
+        scheduled = false;
+        var start = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - overscan);
+        var end = Math.min(rows.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / rowHeight) + overscan);
+        if (start === first && end === last) return;
+        first = start;
+        last = end;
+        var fragment = document.createDocumentFragment();
+        for (var i = start; i < end; i++) fragment.appendChild(renderRow(rows[i]));
+        visible.style.transform = "translateY(" + (start * rowHeight) + "px)";
+        visible.replaceChildren(fragment);
+    }
+    function schedule() {
+        if (!scheduled) {
+            scheduled = true;
+            window.requestAnimationFrame(update);
+        }
+    }
+    viewport.addEventListener("scroll", schedule);
+    window.addEventListener("resize", schedule);
+    update();
+})();
+    </script>
+    </body>
+</html>
+"""
+DEFAULT_ROW_HEIGHT = 240
+DEFAULT_SERVE_PAGE_SIZE = 100
+_PAGE_FILENAME_FORMAT = "page-{:05d}.html"
+_INDEX_FILENAME = "index.html"
+_MANIFEST_FILENAME = ".htmljux-manifest.json"
+_MANIFEST_VERSION = 1
+_DEFAULT_TEMPLATE_NAME = "htmljux:default.html"
+_INDEX_TEMPLATE_NAME = "htmljux:index.html"
+_VIRTUAL_TEMPLATE_NAME = "htmljux:virtual.html"
+_JSON_ESCAPES = str.maketrans({'<': '\\u003c', '>': '\\u003e', '&': '\\u0026'})
+_ENVIRONMENTS = {}
+
 class Image(object):
 
-    def __init__(self, url, title):
+    def __init__(self, url, title, path=None):
         self.url = url
         self.title = title
+        self.path = path
+        self.link_url = None
+        self.width = None
+        self.height = None
 
 
 class Row(object):
@@ -85,10 +251,24 @@ class Row(object):
         self.images = images
 
 
+class PageInfo(object):
+
+    def __init__(self, number: int, url: str, first_row: int, last_row: int,
+                 prev_url: Optional[str]=None, next_url: Optional[str]=None, index_url: Optional[str]=None):
+        self.number = number
+        self.url = url
+        self.first_row = first_row
+        self.last_row = last_row
+        self.prev_url = prev_url
+        self.next_url = next_url
+        self.index_url = index_url
+
+
 class PageModel(object):
 
-    def __init__(self, rows: Iterator[Row]):
-        self.rows = rows if isinstance(rows, list) else list(rows)
+    def __init__(self, rows: Iterable[Row], page: Optional[PageInfo]=None):
+        self.rows = rows
+        self.page = page
 
 
 class Renderer(object):
@@ -97,11 +277,20 @@ class Renderer(object):
         self.template = template
         self.css = css
 
-    def render(self, page_model: PageModel):
-        _log.debug("rendering %d rows", len(page_model.rows))
-        page_attrs = vars(page_model)
+    def _page_attrs(self, page_model: PageModel) -> Dict:
+        page_attrs = dict(vars(page_model))
         page_attrs['css'] = self.css or ''
-        return self.template.render(**page_attrs)
+        return page_attrs
+
+    def render(self, page_model: PageModel):
+        if isinstance(page_model.rows, list):
+            _log.debug("rendering %d rows", len(page_model.rows))
+        return self.template.render(**self._page_attrs(page_model))
+
+    def stream(self, page_model: PageModel, ofile: TextIO):
+        """Render the page to an output stream piece by piece. Rows are consumed as
+        the template reaches them, so the page is never held in memory as a whole."""
+        self.template.stream(**self._page_attrs(page_model)).dump(ofile)
 
 
 class SortSpecification(tuple):
@@ -137,38 +326,59 @@ class Extractor(object):
                         pre_predicate=None,
                         sort_spec: Optional[SortSpecification]=None,
                         post_predicate=None) -> Iterator:
-        erow_iterator = enumerate(csv.reader(ifile, **self.csv_args))
-        if sort_spec is None and (pre_predicate is None or pre_predicate is predicates.always_true()):
-            return erow_iterator
-        some_rows = filter(pre_predicate or predicates.always_true(), erow_iterator)
-        some_rows = list(map(operator.itemgetter(1), some_rows))
-        if sort_spec is not None:
+        return self._select_rows(csv.reader(ifile, **self.csv_args), pre_predicate, sort_spec, post_predicate)
+
+    def _select_rows(self, rows: Iterable[List[str]],
+                     pre_predicate=None,
+                     sort_spec: Optional[SortSpecification]=None,
+                     post_predicate=None) -> Iterator:
+        erow_iterator = enumerate(rows)
+        if pre_predicate is not None and pre_predicate is not predicates.always_true():
+            erow_iterator = filter(pre_predicate, erow_iterator)
+        some_rows = map(operator.itemgetter(1), erow_iterator)
+        if sort_spec is not None and isinstance(post_predicate, RowLimit):
+            # selecting with a heap keeps only limit rows in memory, and nsmallest and
+            # nlargest return the same rows in the same order as a stable sort
+            sort_key, reverse = sort_spec
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            some_rows = select(post_predicate.limit, some_rows, key=sort_key)
+        elif sort_spec is not None:
+            some_rows = list(some_rows)
             sort_key, reverse = sort_spec
             _log.debug("sorting %d rows from input", len(some_rows))
             some_rows.sort(key=sort_key, reverse=reverse)
-        post_predicate = post_predicate or predicates.always_true()
         # assert all(map(lambda row: all(map(lambda x: isinstance(x, str), row)), some_rows)), f"expect some_rows to be list of lists of strings"
-        return filter(post_predicate, enumerate(some_rows))
+        erow_iterator = enumerate(some_rows)
+        if isinstance(post_predicate, RowLimit):
+            # a limit accepts a prefix of the rows, so reading can stop at the end of it
+            erow_iterator = itertools.islice(erow_iterator, max(0, post_predicate.limit))
+        elif post_predicate is not None and post_predicate is not predicates.always_true():
+            erow_iterator = filter(post_predicate, erow_iterator)
+        return erow_iterator
 
     def extract(self,
                 ifile: TextIO,
                 pre_predicate: Optional[Callable]=None,
                 sort_spec: Optional[SortSpecification]=None,
-                post_predicate: Optional[Callable]=None):
+                post_predicate: Optional[Callable]=None) -> Iterator[Row]:
+        """Yield a Row for each CSV row that passes the filters. Rows are read from the
+        input lazily unless a sort is specified, in which case all rows that pass the
+        pre-sort filter are read before the first Row is yielded."""
         assert sort_spec is None or isinstance(sort_spec, SortSpecification), f"sort_spec has wrong type: {sort_spec}"
-        rows = []
         for row_index, row in self._enumerate_rows(ifile, pre_predicate, sort_spec, post_predicate):
-            # assert all(map(lambda c: isinstance(c, str), row)), f"expect row to contain strings: {row}"
-            caption=None
-            if self.caption_column is not None:
-                caption = row[self.caption_column]
-            if self.image_pathname_columns is None:
-                image_columns = [row[i] for i in range(len(row)) if i != self.caption_column]
-            else:
-                image_columns = [row[i] for i in self.image_pathname_columns]
-            images = list(filter(predicates.not_none(), map(lambda v: self._transform_cell(row_index, v), image_columns)))
-            rows.append(Row(caption, images))
-        return rows
+            yield self.make_row(row_index, row)
+
+    def make_row(self, row_index: int, row: List[str]) -> Row:
+        # assert all(map(lambda c: isinstance(c, str), row)), f"expect row to contain strings: {row}"
+        caption=None
+        if self.caption_column is not None:
+            caption = row[self.caption_column]
+        if self.image_pathname_columns is None:
+            image_columns = [row[i] for i in range(len(row)) if i != self.caption_column]
+        else:
+            image_columns = [row[i] for i in self.image_pathname_columns]
+        images = list(filter(predicates.not_none(), map(lambda v: self._transform_cell(row_index, v), image_columns)))
+        return Row(caption, images)
 
 
 def make_cell_value_transform(args: Namespace) -> Callable[[str], Image]:
@@ -184,6 +394,7 @@ def make_cell_value_transform(args: Namespace) -> Callable[[str], Image]:
                 cell_value = os.path.join(os.path.abspath(parent_dir), cell_value)
             url = pathlib.Path(cell_value).as_uri()
             title = os.path.basename(cell_value)
+            return Image(url, title, cell_value)
         elif args.scheme == 'http' or args.scheme == 'https':
             url = args.scheme + '://' + cell_value
             title = os.path.basename(urllib.parse.urlparse(url).path)
@@ -202,6 +413,17 @@ def _try_float(token: str):
         return math.nan
 
 
+def _numeric_sort_key(token: str, reverse: bool=False) -> Tuple[bool, float]:
+    """Returns a sort key that orders numbers by value. Tokens that are not numbers,
+    such as a header, sort before all numbers in either direction, so the key for
+    a reverse sort ranks them above every number. NaN does not compare consistently,
+    so it is not used as a key."""
+    value = _try_float(token)
+    if value != value:
+        return reverse, 0.0
+    return not reverse, value
+
+
 def make_sort_key(sort_key_def: Optional[str], caption_column: Optional[int]) -> Optional[SortSpecification]:
     if sort_key_def is None:
         return None
@@ -218,7 +440,7 @@ def make_sort_key(sort_key_def: Optional[str], caption_column: Optional[int]) ->
     if mode == 'numeric':
         if column is None:
             raise ValueError("must specify sort column in numeric mode")
-        sort_key = lambda row: _try_float(row[column])
+        sort_key = lambda row: _numeric_sort_key(row[column], rev)
     else:
         if column is None:
             sort_key = tuple
@@ -227,6 +449,289 @@ def make_sort_key(sort_key_def: Optional[str], caption_column: Optional[int]) ->
     return SortSpecification(sort_key, rev)
 
 
+def _cache_home() -> str:
+    return os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+
+def default_thumbnail_cache_dir() -> str:
+    return os.path.join(_cache_home(), 'smatterscripts', 'htmljux-thumbnails')
+
+
+def default_image_size_index() -> str:
+    return os.path.join(_cache_home(), 'smatterscripts', 'htmljux-image-sizes.tsv')
+
+
+def default_template_cache_dir() -> str:
+    return os.path.join(_cache_home(), 'smatterscripts', 'htmljux-templates')
+
+
+def make_environment(template_dir: Optional[str]=None, bytecode_cache_dir: Optional[str]=None) -> jinja2.Environment:
+    """Create an environment that resolves the built-in templates plus any templates
+    in template_dir. If bytecode_cache_dir is given, compiled templates are stored
+    there and reused by later invocations until the template source changes."""
+    loaders = [jinja2.DictLoader({
+        _DEFAULT_TEMPLATE_NAME: DEFAULT_TEMPLATE,
+        _INDEX_TEMPLATE_NAME: INDEX_TEMPLATE,
+        _VIRTUAL_TEMPLATE_NAME: VIRTUAL_TEMPLATE,
+    })]
+    if template_dir is not None:
+        loaders.append(jinja2.FileSystemLoader(template_dir))
+    bytecode_cache = None
+    if bytecode_cache_dir is not None:
+        try:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+        except OSError as e:
+            _log.warning("template cache disabled: %s", e)
+    return jinja2.Environment(
+        loader=jinja2.ChoiceLoader(loaders),
+        bytecode_cache=bytecode_cache,
+        autoescape=jinja2.select_autoescape(['html', 'xml'], default=True),
+    )
+
+
+def _get_environment(template_dir: Optional[str], bytecode_cache_dir: Optional[str]) -> jinja2.Environment:
+    key = (template_dir, bytecode_cache_dir)
+    env = _ENVIRONMENTS.get(key)
+    if env is None:
+        env = make_environment(template_dir, bytecode_cache_dir)
+        _ENVIRONMENTS[key] = env
+    return env
+
+
+def load_template(template: Optional[str]=None, bytecode_cache_dir: Optional[str]=None,
+                  default_name: str=_DEFAULT_TEMPLATE_NAME) -> jinja2.Template:
+    """Load a template file, or a built-in template if template is None. Environments
+    are shared within a process, so each template is compiled at most once per process
+    (and at most once overall while the bytecode cache is warm)."""
+    if template is None:
+        return _get_environment(None, bytecode_cache_dir).get_template(default_name)
+    template = os.path.abspath(template)
+    env = _get_environment(os.path.dirname(template), bytecode_cache_dir)
+    return env.get_template(os.path.basename(template))
+
+
+def _make_thumbnail(task: Tuple[str, str, int, str]) -> Optional[str]:
+    source_path, thumbnail_path, size, image_format = task
+    from PIL import Image as PILImage
+    try:
+        with PILImage.open(source_path) as im:
+            if im.format == 'JPEG':
+                im.draft('RGB', (size, size))
+            im.thumbnail((size, size))
+            if image_format == 'JPEG' and im.mode not in ('RGB', 'L'):
+                im = im.convert('RGB')
+            temp_path = f"{thumbnail_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            im.save(temp_path, image_format)
+        os.replace(temp_path, thumbnail_path)
+        return thumbnail_path
+    except Exception as e:
+        _log.debug("failed to make thumbnail of %s due to %s: %s", source_path, type(e), e)
+        return None
+
+
+class Thumbnailer(object):
+
+    """Replaces image URLs with URLs of downscaled copies of the images.
+
+    Thumbnails are generated with Pillow in a process pool and cached in a directory,
+    named by a hash of the source pathname, modification time and size and the
+    thumbnail size and format, so that unchanged images are not processed again.
+    Only images that have local pathnames are thumbnailed."""
+
+    batch_size = 256
+
+    def __init__(self, size: int, cache_dir: Optional[str]=None, image_format: str='jpeg', jobs: Optional[int]=None):
+        self.size = size
+        self.cache_dir = cache_dir or default_thumbnail_cache_dir()
+        self.image_format = image_format.upper()
+        self.jobs = jobs
+        self._pool = None
+
+    def __enter__(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._pool = multiprocessing.Pool(self.jobs)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._pool.__exit__(exc_type, exc_val, exc_tb)
+        self._pool = None
+        return False
+
+    def thumbnail_path(self, source_path: str) -> Optional[str]:
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return None
+        key = "\0".join([os.path.abspath(source_path), str(stat.st_mtime_ns), str(stat.st_size), str(self.size), self.image_format])
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.cache_dir, digest + ('.webp' if self.image_format == 'WEBP' else '.jpg'))
+
+    def make(self, source_path: str) -> Optional[str]:
+        """Return the pathname of the thumbnail of an image, generating it in the calling
+        thread if it is not cached. Does not require the process pool."""
+        thumbnail_path = self.thumbnail_path(source_path)
+        if thumbnail_path is None or os.path.exists(thumbnail_path):
+            return thumbnail_path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return _make_thumbnail((source_path, thumbnail_path, self.size, self.image_format))
+
+    def _apply_batch(self, rows: List[Row]):
+        targets, tasks = [], {}
+        for row in rows:
+            for image in row.images:
+                if image.path is None:
+                    continue
+                thumbnail_path = self.thumbnail_path(image.path)
+                if thumbnail_path is None:
+                    continue
+                targets.append((image, thumbnail_path))
+                if thumbnail_path not in tasks and not os.path.exists(thumbnail_path):
+                    tasks[thumbnail_path] = (image.path, thumbnail_path, self.size, self.image_format)
+        created = set(filter(None, self._pool.imap_unordered(_make_thumbnail, tasks.values())))
+        for image, thumbnail_path in targets:
+            if thumbnail_path in created or thumbnail_path not in tasks:
+                image.link_url = image.url
+                image.url = pathlib.Path(thumbnail_path).as_uri()
+                image.path = thumbnail_path
+
+    def apply(self, rows: Iterable[Row]) -> Iterator[Row]:
+        """Yield rows with image URLs that point to thumbnails. Rows are processed in
+        batches, so rows are not all held in memory at once."""
+        assert self._pool is not None, "thumbnailer must be used as a context manager"
+        rows = iter(rows)
+        for batch in iter(lambda: list(itertools.islice(rows, self.batch_size)), []):
+            self._apply_batch(batch)
+            yield from batch
+
+
+def _probe_image_size(path: str) -> Optional[Tuple[int, int]]:
+    from PIL import Image as PILImage
+    try:
+        # opening an image reads only its header; pixel data is loaded on demand
+        with PILImage.open(path) as im:
+            return im.size
+    except Exception as e:
+        _log.debug("failed to read size of %s due to %s: %s", path, type(e), e)
+        return None
+
+
+class ImageSizer(object):
+
+    """Sets the width and height of images that have local pathnames.
+
+    Sizes are read from image headers with Pillow in a thread pool, without decoding
+    pixel data, and cached in an index file keyed by pathname, modification time and
+    size, so that unchanged images are not opened again. Each line of the index is
+    WIDTH, HEIGHT, MTIME_NS, SIZE and PATH, delimited by tabs. New entries are
+    appended, and the index is rewritten on exit if any of its lines are superseded."""
+
+    batch_size = 1024
+
+    def __init__(self, index_pathname: Optional[str]=None, jobs: Optional[int]=None):
+        self.index_pathname = index_pathname or default_image_size_index()
+        self.jobs = jobs
+        self._sizes = {}
+        self._stale_lines = 0
+        self._executor = None
+        self._index_file = None
+
+    def __enter__(self):
+        self._load_index()
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_pathname)), exist_ok=True)
+        self._index_file = open(self.index_pathname, 'a', encoding='utf-8', errors='surrogateescape')
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.jobs or min(32, 4 * (os.cpu_count() or 1)))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._executor.shutdown()
+        self._executor = None
+        self._index_file.close()
+        self._index_file = None
+        if self._stale_lines > 0:
+            self._rewrite_index()
+        return False
+
+    def _rewrite_index(self):
+        temp_pathname = f"{self.index_pathname}.{os.getpid()}.tmp"
+        with open(temp_pathname, 'w', encoding='utf-8', errors='surrogateescape') as ofile:
+            for path, (mtime_ns, size, width, height) in self._sizes.items():
+                if "\n" not in path:
+                    print(width, height, mtime_ns, size, path, sep="\t", file=ofile)
+        os.replace(temp_pathname, self.index_pathname)
+        _log.debug("rewrote image size index without %d stale lines", self._stale_lines)
+        self._stale_lines = 0
+
+    def _load_index(self):
+        try:
+            with open(self.index_pathname, 'r', encoding='utf-8', errors='surrogateescape') as ifile:
+                for line in ifile:
+                    fields = line.rstrip("\n").split("\t", 4)
+                    try:
+                        width, height, mtime_ns, size = map(int, fields[:4])
+                        if fields[4] in self._sizes:
+                            self._stale_lines += 1
+                        self._sizes[fields[4]] = (mtime_ns, size, width, height)
+                    except (ValueError, IndexError):
+                        _log.debug("ignoring malformed image size index line %r", line)
+                        self._stale_lines += 1
+        except FileNotFoundError:
+            pass
+
+    def _lookup(self, path: str) -> Tuple[str, Optional[Tuple[int, int, int, int]], bool]:
+        """Return the absolute path, the index entry for the path, and whether the entry is new."""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, None, False
+        entry = self._sizes.get(path)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return path, entry, False
+        dimensions = _probe_image_size(path)
+        if dimensions is None:
+            return path, None, False
+        return path, (stat.st_mtime_ns, stat.st_size) + tuple(dimensions), True
+
+    def _apply_batch(self, rows: List[Row]):
+        images = [image for row in rows for image in row.images if image.path is not None]
+        paths = list(dict.fromkeys(image.path for image in images))
+        entries = {}
+        for path, (abs_path, entry, is_new) in zip(paths, self._executor.map(self._lookup, paths)):
+            if entry is None:
+                continue
+            entries[path] = entry
+            if is_new:
+                if abs_path in self._sizes:
+                    self._stale_lines += 1
+                self._sizes[abs_path] = entry
+                if "\n" not in abs_path:
+                    mtime_ns, size, width, height = entry
+                    print(width, height, mtime_ns, size, abs_path, sep="\t", file=self._index_file)
+        for image in images:
+            entry = entries.get(image.path)
+            if entry is not None:
+                image.width, image.height = entry[2:]
+
+    def apply(self, rows: Iterable[Row]) -> Iterator[Row]:
+        """Yield rows with image dimensions set where they can be determined. Rows are
+        processed in batches, so rows are not all held in memory at once."""
+        assert self._executor is not None, "image sizer must be used as a context manager"
+        rows = iter(rows)
+        for batch in iter(lambda: list(itertools.islice(rows, self.batch_size)), []):
+            self._apply_batch(batch)
+            yield from batch
+
+
+def _decorate_rows(rows: Iterable[Row], thumbnailer: Optional[Thumbnailer]=None,
+                   image_sizer: Optional[ImageSizer]=None) -> Iterable[Row]:
+    if thumbnailer is not None:
+        rows = thumbnailer.apply(rows)
+    if image_sizer is not None:
+        rows = image_sizer.apply(rows)
+    return rows
+
+
 def perform(ifile: TextIO,
             extractor: Extractor,
             pre_predicate: Optional[Callable]=None,
@@ -234,23 +739,419 @@ def perform(ifile: TextIO,
             post_predicate: Optional[Callable]=None,
             template: Optional[str]=None,
             css_file: Optional[str]=None,
-            ofile: TextIO=sys.stdout):
+            ofile: TextIO=sys.stdout,
+            thumbnailer: Optional[Thumbnailer]=None,
+            template_cache: Optional[str]=None,
+            image_sizer: Optional[ImageSizer]=None):
     rows = extractor.extract(ifile, pre_predicate, sort_spec, post_predicate)
+    rows = _decorate_rows(rows, thumbnailer, image_sizer)
     page_model = PageModel(rows)
-    env = jinja2.Environment(
-        autoescape=jinja2.select_autoescape(['html', 'xml'])
-    )
+    css = _read_css(css_file)
+    renderer = Renderer(load_template(template, template_cache), css)
+    renderer.stream(page_model, ofile)
+    print(file=ofile)
+
+
+def _row_json(row: Row) -> str:
+    images = [[image.url, image.title, image.link_url, image.width, image.height] for image in row.images]
+    text = json.dumps([row.caption, images], separators=(',', ':'), ensure_ascii=False)
+    return text.translate(_JSON_ESCAPES)
+
+
+def iter_rows_json(rows: Iterable[Row]) -> Iterator[str]:
+    """Encode rows as a compact JSON array, one chunk per row. Characters that are
+    significant in HTML are escaped, so the output is safe to embed in a script element."""
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i > 0 else '') + _row_json(row)
+    yield ']'
+
+
+def perform_virtual(ifile: TextIO,
+                    extractor: Extractor,
+                    pre_predicate: Optional[Callable]=None,
+                    sort_spec: Optional[SortSpecification]=None,
+                    post_predicate: Optional[Callable]=None,
+                    template: Optional[str]=None,
+                    css_file: Optional[str]=None,
+                    ofile: TextIO=sys.stdout,
+                    thumbnailer: Optional[Thumbnailer]=None,
+                    template_cache: Optional[str]=None,
+                    image_sizer: Optional[ImageSizer]=None,
+                    row_height: int=DEFAULT_ROW_HEIGHT):
+    """Write a page that embeds the rows as JSON and renders only the rows that are
+    scrolled into view. Rows are encoded as the template reaches them, so they are
+    streamed to the output rather than held in memory."""
+    rows = extractor.extract(ifile, pre_predicate, sort_spec, post_predicate)
+    rows = _decorate_rows(rows, thumbnailer, image_sizer)
+    css = _read_css(css_file)
+    template = load_template(template, template_cache, _VIRTUAL_TEMPLATE_NAME)
+    template.stream(rows_json=iter_rows_json(rows), row_height=row_height, css=css or '').dump(ofile)
+    print(file=ofile)
+
+
+def _read_css(css_file: Optional[str]) -> Optional[str]:
+    if css_file is None:
+        return None
+    with open(css_file, 'r') as ifile:
+        return ifile.read()
+
+
+def _render_page(task: Tuple[Optional[str], Optional[str], Optional[str], List[Row], PageInfo, str]) -> str:
+    template, template_cache, css, rows, page, output_pathname = task
+    renderer = Renderer(load_template(template, template_cache), css)
+    with open(output_pathname, 'w') as ofile:
+        renderer.stream(PageModel(rows, page), ofile)
+        print(file=ofile)
+    return output_pathname
+
+
+def _template_digest(template: Optional[str]) -> str:
+    h = hashlib.sha1()
     if template is None:
-        template = env.from_string(DEFAULT_TEMPLATE)
+        h.update(DEFAULT_TEMPLATE.encode('utf-8'))
     else:
-        raise NotImplementedError("custom template")
-    css = None
-    if css_file is not None:
-        with open(css_file, 'r') as ifile:
-            css = ifile.read()
-    renderer = Renderer(template, css)
-    rendering = renderer.render(page_model)
-    print(rendering, file=ofile)
+        with open(template, 'rb') as ifile:
+            h.update(ifile.read())
+    return h.hexdigest()
+
+
+def _page_digest(base_digest: str, page: PageInfo, rows: List[Row]) -> str:
+    """Return a hash of everything that determines the content of a page."""
+    h = hashlib.sha1(base_digest.encode('ascii'))
+    h.update(json.dumps(vars(page), sort_keys=True).encode('utf-8'))
+    for row in rows:
+        h.update(b"\n")
+        h.update(_row_json(row).encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+
+def _load_manifest(output_dir: str) -> Dict[str, str]:
+    try:
+        with open(os.path.join(output_dir, _MANIFEST_FILENAME), 'r') as ifile:
+            manifest = json.load(ifile)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        _log.warning("ignoring invalid manifest: %s", e)
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('version') != _MANIFEST_VERSION:
+        return {}
+    return manifest.get('pages', {})
+
+
+def _save_manifest(output_dir: str, page_digests: Dict[str, str]):
+    pathname = os.path.join(output_dir, _MANIFEST_FILENAME)
+    temp_pathname = pathname + ".tmp"
+    with open(temp_pathname, 'w') as ofile:
+        json.dump({'version': _MANIFEST_VERSION, 'pages': page_digests}, ofile, indent=0, sort_keys=True)
+    os.replace(temp_pathname, pathname)
+
+
+def perform_pages(ifile: TextIO,
+                  extractor: Extractor,
+                  output_dir: str,
+                  page_size: int,
+                  pre_predicate: Optional[Callable]=None,
+                  sort_spec: Optional[SortSpecification]=None,
+                  post_predicate: Optional[Callable]=None,
+                  template: Optional[str]=None,
+                  css_file: Optional[str]=None,
+                  jobs: Optional[int]=None,
+                  thumbnailer: Optional[Thumbnailer]=None,
+                  template_cache: Optional[str]=None,
+                  image_sizer: Optional[ImageSizer]=None,
+                  rebuild: bool=False) -> List[PageInfo]:
+    """Write rows to a sequence of pages of at most page_size rows each, plus an index
+    page that links to them. Pages are rendered concurrently in a process pool; at
+    most a few pages per worker are held in memory at once.
+
+    A manifest of page content hashes is kept in the output directory, and pages
+    whose rows, position, template and stylesheet are unchanged since the previous
+    run are not rewritten unless rebuild is true. Pages beyond the last page are removed."""
+    css = _read_css(css_file)
+    os.makedirs(output_dir, exist_ok=True)
+    previous_digests = {} if rebuild else _load_manifest(output_dir)
+    with contextlib.suppress(FileNotFoundError):
+        # a run that fails partway must not leave a manifest that vouches for stale pages
+        os.remove(os.path.join(output_dir, _MANIFEST_FILENAME))
+    base_digest = hashlib.sha1("\0".join([_template_digest(template), css or '']).encode('utf-8')).hexdigest()
+    page_digests = {}
+    rows = extractor.extract(ifile, pre_predicate, sort_spec, post_predicate)
+    rows = _decorate_rows(rows, thumbnailer, image_sizer)
+    chunks = iter(lambda: list(itertools.islice(rows, page_size)), [])
+    window = 2 * (jobs or os.cpu_count() or 1)
+    pages, rendered = [], 0
+    with multiprocessing.Pool(jobs) as pool:
+        pending = collections.deque()
+        chunk = next(chunks, None)
+        while chunk is not None:
+            following = next(chunks, None)
+            number = len(pages) + 1
+            first_row = (pages[-1].last_row + 1) if pages else 0
+            page = PageInfo(number, _PAGE_FILENAME_FORMAT.format(number), first_row, first_row + len(chunk) - 1,
+                            prev_url=(pages[-1].url if pages else None),
+                            next_url=(_PAGE_FILENAME_FORMAT.format(number + 1) if following is not None else None),
+                            index_url=_INDEX_FILENAME)
+            pages.append(page)
+            output_pathname = os.path.join(output_dir, page.url)
+            page_digests[page.url] = _page_digest(base_digest, page, chunk)
+            if previous_digests.get(page.url) != page_digests[page.url] or not os.path.exists(output_pathname):
+                task = (template, template_cache, css, chunk, page, output_pathname)
+                pending.append(pool.apply_async(_render_page, (task,)))
+                rendered += 1
+            if len(pending) >= window:
+                pending.popleft().get()
+            chunk = following
+        while pending:
+            pending.popleft().get()
+    _log.debug("rendered %d of %d pages", rendered, len(pages))
+    for url in previous_digests.keys() - page_digests.keys():
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(output_dir, url))
+    with open(os.path.join(output_dir, _INDEX_FILENAME), 'w') as ofile:
+        index_template = _get_environment(None, template_cache).get_template(_INDEX_TEMPLATE_NAME)
+        index_template.stream(pages=pages, css=css or '').dump(ofile)
+        print(file=ofile)
+    _save_manifest(output_dir, page_digests)
+    return pages
+
+
+def batch_output_pathname(input_pathname: str, output_dir: str) -> str:
+    return os.path.join(output_dir, pathlib.Path(input_pathname).stem + ".html")
+
+
+def perform_batch(input_pathnames: Sequence[str],
+                  extractor: Extractor,
+                  output_dir: str,
+                  pre_predicate: Optional[Callable]=None,
+                  sort_spec: Optional[SortSpecification]=None,
+                  post_predicate: Optional[Callable]=None,
+                  template: Optional[str]=None,
+                  css_file: Optional[str]=None,
+                  thumbnailer: Optional[Thumbnailer]=None,
+                  template_cache: Optional[str]=None,
+                  image_sizer: Optional[ImageSizer]=None) -> List[str]:
+    """Render each input CSV file to a page in output_dir named after the input file.
+    All pages are rendered in this process with one template environment, so the
+    template is loaded and compiled once for the whole batch."""
+    output_pathnames = [batch_output_pathname(pathname, output_dir) for pathname in input_pathnames]
+    duplicates = sorted(name for name, count in collections.Counter(output_pathnames).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"multiple inputs would be written to {duplicates[0]}")
+    os.makedirs(output_dir, exist_ok=True)
+    for input_pathname, output_pathname in zip(input_pathnames, output_pathnames):
+        with open(input_pathname, 'r') as ifile:
+            with open(output_pathname, 'w') as ofile:
+                perform(ifile, extractor, pre_predicate, sort_spec, post_predicate, template, css_file,
+                        ofile=ofile, thumbnailer=thumbnailer, template_cache=template_cache, image_sizer=image_sizer)
+    _log.debug("rendered %d pages in batch", len(output_pathnames))
+    return output_pathnames
+
+
+class _LineReader(object):
+
+    """Iterator over the lines of a binary file, decoded, that keeps track of the
+    byte offset of the end of the last line read."""
+
+    def __init__(self, bfile, encoding: str):
+        self.bfile = bfile
+        self.encoding = encoding
+        self.position = bfile.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.bfile.readline()
+        if not line:
+            raise StopIteration
+        self.position += len(line)
+        return line.decode(self.encoding, 'surrogateescape')
+
+
+class _OffsetRow(list):
+
+    """CSV row that knows the byte offset at which it starts in the input file."""
+
+    __slots__ = ('offset',)
+
+
+def _read_offset_rows(bfile, csv_args: Dict, encoding: str) -> Iterator[_OffsetRow]:
+    # the csv reader consumes exactly the lines of one record per row, so the reader
+    # position before a row is requested is the offset of the row
+    lines = _LineReader(bfile, encoding)
+    reader = csv.reader(lines, **csv_args)
+    while True:
+        offset = lines.position
+        try:
+            row = _OffsetRow(next(reader))
+        except StopIteration:
+            return
+        row.offset = offset
+        yield row
+
+
+class RowIndex(object):
+
+    """Byte offsets of the rows of a CSV file that pass the filters, in output order.
+
+    Building the index reads the file once; afterwards, any row can be read by
+    seeking to its offset, so rows that are never requested are never parsed again."""
+
+    def __init__(self, pathname: str, offsets: Sequence[int], csv_args: Dict=None, encoding: Optional[str]=None):
+        self.pathname = pathname
+        self.offsets = offsets
+        self.csv_args = csv_args or {}
+        self.encoding = encoding or locale.getpreferredencoding(False)
+
+    @classmethod
+    def build(cls, pathname: str, extractor: Extractor,
+              pre_predicate: Optional[Callable]=None,
+              sort_spec: Optional[SortSpecification]=None,
+              post_predicate: Optional[Callable]=None,
+              encoding: Optional[str]=None) -> 'RowIndex':
+        # decode as open() does by default, like the other modes
+        encoding = encoding or locale.getpreferredencoding(False)
+        offsets = array('q')
+        with open(pathname, 'rb') as bfile:
+            rows = _read_offset_rows(bfile, extractor.csv_args, encoding)
+            for _, row in extractor._select_rows(rows, pre_predicate, sort_spec, post_predicate):
+                offsets.append(row.offset)
+        _log.debug("indexed %d rows of %s", len(offsets), pathname)
+        return cls(pathname, offsets, extractor.csv_args, encoding)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_rows(self, start: int, stop: int) -> List[List[str]]:
+        """Read the rows at positions start (inclusive) to stop (exclusive)."""
+        rows = []
+        with open(self.pathname, 'rb') as bfile:
+            for offset in self.offsets[start:stop]:
+                bfile.seek(offset)
+                rows.append(next(csv.reader(_LineReader(bfile, self.encoding), **self.csv_args)))
+        return rows
+
+
+class Previewer(object):
+
+    """Renders pages, and locates images and thumbnails, on request.
+
+    Image URLs refer to the previewer rather than to files, so that a browser can load
+    them from a page that is served over HTTP. Thumbnails are generated when they are
+    first requested."""
+
+    def __init__(self, row_index: RowIndex, extractor: Extractor, page_size: int,
+                 template: Optional[str]=None,
+                 css: Optional[str]=None,
+                 thumbnailer: Optional[Thumbnailer]=None,
+                 template_cache: Optional[str]=None):
+        self.row_index = row_index
+        self.extractor = extractor
+        self.page_size = page_size
+        self.template = template
+        self.css = css
+        self.thumbnailer = thumbnailer
+        self.template_cache = template_cache
+
+    def num_pages(self) -> int:
+        return max(1, (len(self.row_index) + self.page_size - 1) // self.page_size)
+
+    def page_info(self, number: int) -> PageInfo:
+        first_row = (number - 1) * self.page_size
+        last_row = min(len(self.row_index), first_row + self.page_size) - 1
+        return PageInfo(number, _PAGE_FILENAME_FORMAT.format(number), first_row, last_row,
+                        prev_url=(_PAGE_FILENAME_FORMAT.format(number - 1) if number > 1 else None),
+                        next_url=(_PAGE_FILENAME_FORMAT.format(number + 1) if number < self.num_pages() else None),
+                        index_url=_INDEX_FILENAME)
+
+    def render_index(self) -> str:
+        pages = [self.page_info(number) for number in range(1, self.num_pages() + 1)]
+        index_template = _get_environment(None, self.template_cache).get_template(_INDEX_TEMPLATE_NAME)
+        return index_template.render(pages=pages, css=self.css or '')
+
+    def render_page(self, number: int) -> str:
+        if not 1 <= number <= self.num_pages():
+            raise KeyError(number)
+        page = self.page_info(number)
+        rows = []
+        for position, raw_row in enumerate(self.row_index.read_rows(page.first_row, page.last_row + 1), page.first_row):
+            row = self.extractor.make_row(position, raw_row)
+            for k, image in enumerate(row.images):
+                if image.path is not None:
+                    image.link_url = f"/image/{position}/{k}"
+                    image.url = f"/thumbnail/{position}/{k}" if self.thumbnailer is not None else image.link_url
+            rows.append(row)
+        renderer = Renderer(load_template(self.template, self.template_cache), self.css)
+        return renderer.render(PageModel(rows, page))
+
+    def image_path(self, position: int, k: int) -> Optional[str]:
+        if not 0 <= position < len(self.row_index):
+            return None
+        images = self.extractor.make_row(position, self.row_index.read_rows(position, position + 1)[0]).images
+        return images[k].path if 0 <= k < len(images) else None
+
+    def thumbnail_path(self, position: int, k: int) -> Optional[str]:
+        path = self.image_path(position, k)
+        if path is None or self.thumbnailer is None:
+            return None
+        return self.thumbnailer.make(path)
+
+
+class _PreviewRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    _PAGE_PATTERN = re.compile(r'^/page-(\d+)\.html$')
+    _IMAGE_PATTERN = re.compile(r'^/(image|thumbnail)/(\d+)/(\d+)$')
+
+    def do_GET(self):
+        previewer = self.server.previewer
+        path = urllib.parse.urlparse(self.path).path
+        try:
+            if path in ('/', '/' + _INDEX_FILENAME):
+                return self._send_html(previewer.render_index())
+            match = self._PAGE_PATTERN.match(path)
+            if match:
+                return self._send_html(previewer.render_page(int(match.group(1))))
+            match = self._IMAGE_PATTERN.match(path)
+            if match:
+                locate = previewer.image_path if match.group(1) == 'image' else previewer.thumbnail_path
+                file_path = locate(int(match.group(2)), int(match.group(3)))
+                if file_path is not None and os.path.isfile(file_path):
+                    return self._send_file(file_path)
+        except KeyError:
+            pass
+        self.send_error(404)
+
+    def _send_html(self, html: str):
+        content = html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_file(self, path: str):
+        with open(path, 'rb') as ifile:
+            self.send_response(200)
+            self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(ifile.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(ifile, self.wfile)
+
+    def log_message(self, format, *args):
+        _log.debug("%s - %s", self.address_string(), format % args)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+
+def make_preview_server(previewer: Previewer, port: int, host: str='127.0.0.1') -> _ThreadingHTTPServer:
+    server = _ThreadingHTTPServer((host, port), _PreviewRequestHandler)
+    server.previewer = previewer
+    return server
 
 
 def make_row_pre_filter(skip: Optional[int]=None, redaction_filter: Optional[Callable[[str], bool]]=None):
@@ -266,11 +1167,21 @@ def make_row_pre_filter(skip: Optional[int]=None, redaction_filter: Optional[Cal
     return predicate
 
 
+class RowLimit(object):
+
+    """Predicate that accepts enumerated rows whose index is less than a limit."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+
+    def __call__(self, erow):
+        return erow[0] < self.limit
+
+
 def make_row_post_filter(limit: Optional[int]=None):
-    predicate = predicates.always_true()
-    if limit is not None:
-        predicate =  predicates.And(predicate, lambda erow: erow[0] < limit)
-    return predicate
+    if limit is None:
+        return predicates.always_true()
+    return RowLimit(limit)
 
 
 def main(args: Sequence[str]=None, stdout: TextIO=sys.stdout, stderr: TextIO=sys.stderr):
@@ -278,12 +1189,21 @@ def main(args: Sequence[str]=None, stdout: TextIO=sys.stdout, stderr: TextIO=sys
                             epilog="""All row/column indexes are zero-based.
 Syntax of --sort argument is MODE[:K] where MODE is 'numeric', or 'lexicographical'
 and K is column index. Caption column is the default index for sorting. 
+In numeric mode, rows whose sort cell is not a number, such as a header row,
+come first in input order, for both ascending and descending sorts.
 Redaction and --skip are applied before sorting; --limit is applied after.""",
                             allow_abbrev=False)
-    parser.add_argument("input", nargs='?', default="/dev/stdin", help="input CSV file", metavar="FILE")
+    parser.add_argument("input", nargs='*', help="input CSV file; default is standard input; multiple files require --batch", metavar="FILE")
     parser.add_argument("--caption", type=int, help="set caption column", metavar="K")
     parser.add_argument("--images", help="column indexes of cell values to transform to image URIs (comma-delimited)", metavar="COLS")
-    parser.add_argument("--template", metavar="FILE", help="set HTML template")
+    parser.add_argument("--template", metavar="FILE", help="set HTML template; static mode only")
+    parser.add_argument("--template-cache", metavar="DIR", help="cache compiled templates in DIR, such as " + default_template_cache_dir() + ", to reuse them across invocations")
+    parser.add_argument("--image-sizes", action='store_true', help="set width and height attributes of images (requires pillow; file scheme only)")
+    parser.add_argument("--image-size-index", metavar="FILE", help="cache image sizes in FILE; default is " + default_image_size_index())
+    parser.add_argument("--mode", choices=('static', 'virtual'), default='static', help="set output mode; 'virtual' embeds rows as JSON and renders only visible rows in the browser")
+    parser.add_argument("--row-height", type=int, default=DEFAULT_ROW_HEIGHT, metavar="PX", help="set row height in virtual mode; default is %(default)s")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="serve pages of --page-size rows (default %d) on localhost, rendering pages and thumbnails on request" % DEFAULT_SERVE_PAGE_SIZE)
+    parser.add_argument("--batch", metavar="DIR", help="render each input file to DIR/NAME.html, where NAME is the input filename without suffix")
     parser.add_argument("--delimiter", "--delim", "-d", metavar="CHAR",  help="set input delimiter")
     parser.add_argument("--image-root", metavar="DIR", help="prepend parent directory to cell values")
     parser.add_argument("--remove-suffix", metavar="STR", help="remove suffix from cell values")
@@ -294,6 +1214,13 @@ Redaction and --skip are applied before sorting; --limit is applied after.""",
     parser.add_argument("--scheme", choices=('file', 'http', 'https', 'none'), default='file', metavar='SCHEME', help="set scheme for img src attribute value; choices are file, http[s], and none; default is file")
     parser.add_argument("--sort", metavar="[-]MODE[:K]", help="sort rows")
     parser.add_argument("--css", metavar="FILE", help="copy contents of FILE into <style>")
+    parser.add_argument("--page-size", type=int, metavar="N", help="split output into pages of N rows each; requires --output-dir or --serve")
+    parser.add_argument("--output-dir", metavar="DIR", help="write pages and an index page to DIR; pages that are unchanged since the previous run are not rewritten")
+    parser.add_argument("--rebuild", action='store_true', help="rewrite all pages in --output-dir, including unchanged pages")
+    parser.add_argument("--jobs", "-j", type=int, metavar="N", help="render pages and thumbnails in N processes; default is one per core")
+    parser.add_argument("--thumbnails", type=int, metavar="SIZE", help="reference thumbnails no larger than SIZE pixels instead of original images (requires pillow; file scheme only)")
+    parser.add_argument("--thumbnail-format", choices=('jpeg', 'webp'), default='jpeg', help="set thumbnail image format")
+    parser.add_argument("--thumbnail-cache", metavar="DIR", help="cache thumbnails in DIR; default is " + default_thumbnail_cache_dir())
     redaction.support_pattern_args(parser)
     args = parser.parse_args(args)
     if args.print_template:
@@ -319,6 +1246,84 @@ Redaction and --skip are applied before sorting; --limit is applied after.""",
     sort_key = make_sort_key(args.sort, args.caption)
     pre_predicate = make_row_pre_filter(args.skip, redaction_filter)
     post_predicate = make_row_post_filter(args.limit)
-    with open(args.input, 'r') as ifile:
-        perform(ifile, extractor, pre_predicate, sort_key, post_predicate, args.template, args.css)
+    if args.serve is not None:
+        if args.output_dir is not None or args.batch is not None or args.mode != 'static' or args.image_sizes:
+            print(f"{__name__}: --serve does not support --output-dir, --batch, --mode virtual or --image-sizes", file=stderr)
+            return 1
+        if len(args.input) != 1 or not os.path.isfile(args.input[0]):
+            print(f"{__name__}: --serve requires a single regular input file", file=stderr)
+            return 1
+    elif (args.page_size is None) != (args.output_dir is None):
+        print(f"{__name__}: --page-size and --output-dir must be specified together", file=stderr)
+        return 1
+    if args.page_size is not None and args.page_size < 1:
+        print(f"{__name__}: page size must be positive", file=stderr)
+        return 1
+    if args.batch is not None and args.page_size is not None:
+        print(f"{__name__}: --batch and --page-size are mutually exclusive", file=stderr)
+        return 1
+    if args.mode == 'virtual' and (args.batch is not None or args.page_size is not None):
+        print(f"{__name__}: virtual mode writes a single page; --batch and --page-size are not supported", file=stderr)
+        return 1
+    if args.mode == 'virtual' and args.template is not None:
+        print(f"{__name__}: virtual mode uses its own template; --template is not supported", file=stderr)
+        return 1
+    if args.row_height < 1:
+        print(f"{__name__}: row height must be positive", file=stderr)
+        return 1
+    if args.batch is None and len(args.input) > 1:
+        print(f"{__name__}: multiple input files require --batch", file=stderr)
+        return 1
+    if args.batch is not None and not args.input:
+        print(f"{__name__}: --batch requires input files", file=stderr)
+        return 1
+    if not args.input:
+        args.input = ["/dev/stdin"]
+    template_cache = args.template_cache
+    with contextlib.ExitStack() as stack:
+        thumbnailer = None
+        if args.thumbnails is not None:
+            try:
+                import PIL
+            except ImportError:
+                print(f"{__name__}: pillow must be installed to generate thumbnails", file=stderr)
+                return 1
+            thumbnailer = Thumbnailer(args.thumbnails, args.thumbnail_cache, args.thumbnail_format, args.jobs)
+            if args.serve is None:
+                stack.enter_context(thumbnailer)
+        image_sizer = None
+        if args.image_sizes:
+            try:
+                import PIL
+            except ImportError:
+                print(f"{__name__}: pillow must be installed to read image sizes", file=stderr)
+                return 1
+            image_sizer = stack.enter_context(ImageSizer(args.image_size_index, args.jobs))
+        if args.serve is not None:
+            row_index = RowIndex.build(args.input[0], extractor, pre_predicate, sort_key, post_predicate)
+            previewer = Previewer(row_index, extractor, args.page_size or DEFAULT_SERVE_PAGE_SIZE, args.template,
+                                  _read_css(args.css), thumbnailer, template_cache)
+            server = stack.enter_context(make_preview_server(previewer, args.serve))
+            host, port = server.server_address[:2]
+            print(f"serving {len(row_index)} rows on http://{host}:{port}/", file=stdout)
+            stdout.flush()
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            return 0
+        if args.batch is not None:
+            try:
+                perform_batch(args.input, extractor, args.batch, pre_predicate, sort_key, post_predicate, args.template, args.css, thumbnailer, template_cache, image_sizer)
+            except ValueError as e:
+                print(f"{__name__}: {e}", file=stderr)
+                return 1
+            return 0
+        ifile = stack.enter_context(open(args.input[0], 'r'))
+        if args.mode == 'virtual':
+            perform_virtual(ifile, extractor, pre_predicate, sort_key, post_predicate, args.template, args.css, stdout, thumbnailer, template_cache, image_sizer, args.row_height)
+        elif args.page_size is not None:
+            perform_pages(ifile, extractor, args.output_dir, args.page_size, pre_predicate, sort_key, post_predicate, args.template, args.css, args.jobs, thumbnailer, template_cache, image_sizer, args.rebuild)
+        else:
+            perform(ifile, extractor, pre_predicate, sort_key, post_predicate, args.template, args.css, ofile=stdout, thumbnailer=thumbnailer, template_cache=template_cache, image_sizer=image_sizer)
     return 0
@@ -8,8 +8,9 @@
 #  MIT License
 
 from __future__ import print_function
-from _common import StreamContext
+from _common import StreamContext, NullTerminatedInput
 from argparse import ArgumentParser
+import sys
 import random
 import errno
 import logging
@@ -49,20 +50,27 @@ class ReservoirSampler(object):
         return list(map(itemgetter(1), result))
 
 
-def main():
+def main(argl=None):
     parser = ArgumentParser(description="Samples lines from an input stream.", epilog="Bear in mind that the sample is collected in memory before being printed. Exits clean unless I/O error occurs or input is too small.")
     parser.add_argument("k", type=int, metavar="K", help="sample size")
     parser.add_argument("inputfile", nargs='?', help="input file; if absent or - then uses stdin")
     parser.add_argument("-p", "--preserve-order", action="store_true", help="preserve order from stream")
-    args = parser.parse_args()
+    parser.add_argument("-0", "--null", action="store_true", help="read and print null-terminated items, such as output of find -print0")
+    args = parser.parse_args(argl)
     sampler = ReservoirSampler(random.SystemRandom())
     for attr in ('preserve_order',):
         sampler.__setattr__(attr, args.__dict__[attr])
-    with StreamContext(args.inputfile, 'r') as iterator:
+    with StreamContext(args.inputfile, 'rb' if args.null else 'r') as ifile:
+        iterator = NullTerminatedInput(ifile, decode=False) if args.null else ifile
         sample = sampler.collect(iterator, args.k)
     try:
-        for s in sample:
-            print(s, end="")
+        if args.null:
+            for s in sample:
+                sys.stdout.buffer.write(s + b"\0")
+            sys.stdout.buffer.flush()
+        else:
+            for s in sample:
+                print(s, end="")
     except IOError as e:
         if errno.EPIPE == e.errno:
              _log.info("broken pipe; not all items from sample printed")
@@ -7,6 +7,7 @@ import _common
 import logging
 import os.path
 import tempfile
+import unittest.mock
 
 
 _log = logging.getLogger(__name__)
@@ -26,6 +27,53 @@ class NullTerminatedInputTest(TestCase):
         self.test_read(chars)
 
 
+    def test_read_binary(self):
+        nti = NullTerminatedInput(io.BytesIO("a\0b\u00e9\0c\0".encode('utf-8')))
+        self.assertListEqual(['a', 'b\u00e9', 'c'], list(nti))
+
+    def test_read_binary_undecoded(self):
+        nti = NullTerminatedInput(io.BytesIO(b"a\0\xff\0c\0"), decode=False)
+        self.assertListEqual([b'a', b'\xff', b'c'], list(nti))
+
+    def test_read_text_wrapper(self):
+        text = io.TextIOWrapper(io.BytesIO("a\0b\u00e9\0".encode('latin-1')), encoding='latin-1')
+        self.assertListEqual(['a', 'b\u00e9'], NullTerminatedInput(text).readlines())
+
+    def test_read_text_wrapper_utf16(self):
+        text = io.TextIOWrapper(io.BytesIO("a\0\u0100\0".encode('utf-16')), encoding='utf-16')
+        self.assertListEqual(['a', '\u0100'], NullTerminatedInput(text).readlines())
+        with self.assertRaises(ValueError):
+            NullTerminatedInput(io.StringIO("a\0"), decode=False).readlines()
+
+    def test_read_text_wrapper_partially_read(self):
+        text = io.TextIOWrapper(io.BytesIO(b"head\r\na\0b\r\nc\0"), encoding='ascii')
+        self.assertEqual("head\n", text.readline())
+        self.assertListEqual(['a', 'b\nc'], NullTerminatedInput(text).readlines())
+
+    def test_read_mapped_file(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pathname = os.path.join(tempdir, 'paths')
+            with open(pathname, 'wb') as ofile:
+                ofile.write("skip\0a\0\0b\u00e9\0\xff-unterminated".encode('utf-8').replace(b'\xc3\xbf', b'\xff'))
+            for decode, expected in [(True, ['a', '', 'b\u00e9', '\udcff-unterminated']), (False, [b'a', b'', 'b\u00e9'.encode('utf-8'), b'\xff-unterminated'])]:
+                with self.subTest(decode=decode):
+                    with open(pathname, 'rb') as ifile:
+                        ifile.read(5)
+                        nti = NullTerminatedInput(ifile, decode=decode)
+                        self.assertListEqual(expected, list(nti))
+                        self.assertEqual(b'', ifile.read())
+
+    def test_read_spanning_blocks(self):
+        lines = ['', 'x' * 1000, 'y', '', 'z' * 37, 'unterminated']
+        for content in ["\0".join(lines), "\0".join(lines).encode('ascii')]:
+            with self.subTest(type=type(content)):
+                ifile = io.StringIO(content) if isinstance(content, str) else io.BytesIO(content)
+                nti = NullTerminatedInput(ifile)
+                nti.sizehint = 7
+                self.assertListEqual(lines, list(nti))
+                self.assertListEqual([], list(nti))
+
+
 # noinspection PyMethodMayBeStatic
 class StreamContextTest(TestCase):
 
@@ -63,6 +111,18 @@ class StreamContextTest(TestCase):
         self.assertTrue(sys.stdout.writable())
 
 
+    def test_binary_standard_streams(self):
+        stdin, stdout = io.TextIOWrapper(io.BytesIO(b"a\0b\0")), io.TextIOWrapper(io.BytesIO())
+        with unittest.mock.patch('sys.stdin', stdin), unittest.mock.patch('sys.stdout', stdout):
+            with StreamContext('-', 'rb') as ifile:
+                self.assertIs(stdin.buffer, ifile)
+                self.assertEqual(b"a\0b\0", ifile.read())
+            with StreamContext(None, 'wb') as ofile:
+                self.assertIs(stdout.buffer, ofile)
+            with StreamContext('-', 'r') as ifile:
+                self.assertIs(stdin, ifile)
+
+
 class LoggingTest(TestCase):
 
     def test_level_strs(self):
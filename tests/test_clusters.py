@@ -1,6 +1,13 @@
 from unittest import TestCase
 import io
-from shelltools.clusters import UndirectedEdge, UndirectedAdjacencySetGraph, EdgeParser
+from shelltools.clusters import UndirectedEdge, UndirectedAdjacencySetGraph, EdgeParser, DisjointSet
+from shelltools import clusters
+import array
+import random
+import unittest.mock
+import os
+import tempfile
+import contextlib
 import logging
 
 
@@ -74,6 +81,14 @@ class GraphTest(TestCase):
             frozenset({'p', 'n'}),
         }, subgraphs)
 
+    def test_reachable_from_long_chain(self):
+        n = 20000
+        edges = [UndirectedEdge(i, i + 1) for i in range(n)]
+        g = UndirectedAdjacencySetGraph(edges)
+        self.assertEqual(n, len(set(g.reachable_from(0))))
+        self.assertSetEqual({99, 101}, set(g.neighbors(100)))
+        self.assertSetEqual(set(), set(g.neighbors('not a vertex')))
+
     def test_vertexes(self):
         edges = [
             UndirectedEdge('a', 'b'),
@@ -93,6 +108,51 @@ class GraphTest(TestCase):
         self.assertSetEqual(set("abcdefgyxjkmnp"), vertexes)
 
 
+class DisjointSetTest(TestCase):
+
+    def test_union_find(self):
+        d = DisjointSet()
+        self.assertTrue(d.union('a', 'b'))
+        self.assertTrue(d.union('c', 'd'))
+        self.assertFalse(d.union('b', 'a'))
+        self.assertNotEqual(d.find('a'), d.find('c'))
+        self.assertTrue(d.union('b', 'c'))
+        self.assertEqual(d.find('a'), d.find('d'))
+        d.add('e')
+        self.assertSetEqual({frozenset('abcd'), frozenset('e')}, set(d.components()))
+
+    def test_interned_ids(self):
+        d = DisjointSet()
+        self.assertEqual(0, d.add('x'))
+        self.assertEqual(1, d.add('y'))
+        self.assertEqual(0, d.add('x'))
+        self.assertTrue(d.union_id(0, 1))
+        self.assertEqual(d.find('x'), d.find('y'))
+        self.assertListEqual([2], list(d.size[i] for i in range(2) if d.parent[i] == i))
+
+    def test_process_matches_graph(self):
+        rng = random.Random(0xc1a55)
+        vertexes = [str(i) for i in range(200)]
+        pairs = [(rng.choice(vertexes), rng.choice(vertexes)) for _ in range(150)]
+        edges = [UndirectedEdge(u, v) for u, v in pairs]
+        expected = set(UndirectedAdjacencySetGraph(filter(lambda e: len(e) == 2, edges)).connected_subgraphs())
+        text = ''.join(f"1,{u},{v}\n" for u, v in pairs)
+        actual = set(clusters.process(io.StringIO(text), EdgeParser(), clusters.make_weight_filter('ge', 0.5)))
+        self.assertSetEqual(expected, actual)
+
+
+class ProcessTest(TestCase):
+
+    def test_process(self):
+        text = "0.9,a,b\n0.8,b,c\n0.1,c,d\n0.7,e,f\n0.2,f,g\n0.95,h,h\n"
+        weight_filter = clusters.make_weight_filter('ge', 0.5)
+        subgraphs = clusters.process(io.StringIO(text), EdgeParser(), weight_filter)
+        self.assertSetEqual({frozenset('abc'), frozenset('ef')}, set(subgraphs))
+        buffer = io.StringIO()
+        clusters.render_subgraphs(subgraphs, ofile=buffer)
+        self.assertTrue(buffer.getvalue().startswith("3: "))
+
+
 class EdgeParserTest(TestCase):
 
     def test_parse_edges(self):
@@ -112,3 +172,142 @@ class EdgeParserTest(TestCase):
             edge = list(filter(lambda e: e == frozenset(pair), edges))[0]
             self.assertEqual(weight, edge.weight)
 
+    def test_iter_pairs(self):
+        text = "0.9,a,b\n0.1,b,c\n0.5,c,d\n"
+        p = EdgeParser()
+        pairs = list(p.iter_pairs(io.StringIO(text), lambda w: w >= 0.5))
+        self.assertListEqual([('a', 'b'), ('c', 'd')], pairs)
+
+
+class SweepTest(TestCase):
+
+    def test_sweep_matches_process(self):
+        rng = random.Random(0x5ee9)
+        vertexes = [f"v{i}" for i in range(60)]
+        lines = [f"{rng.randint(0, 20) / 20},{rng.choice(vertexes)},{rng.choice(vertexes)}" for _ in range(80)]
+        text = "\n".join(lines)
+        thresholds = [i / 10 for i in range(11)]
+        for operator in ('ge', 'gt', 'le', 'lt'):
+            with self.subTest(operator=operator):
+                merges = clusters.single_linkage(EdgeParser().iter_weighted_pairs(io.StringIO(text)), operator)
+                stats = clusters.sweep_thresholds(merges, thresholds, operator)
+                for threshold, num_clusters, largest in stats:
+                    subgraphs = clusters.process(io.StringIO(text), EdgeParser(), clusters.make_weight_filter(operator, threshold))
+                    self.assertEqual(len(subgraphs), num_clusters)
+                    self.assertEqual(max(map(len, subgraphs), default=0), largest)
+
+    def test_single_linkage_edge_arrays(self):
+        edges = clusters.EdgeArrays()
+        edges.add(0.5, 'a', 'b')
+        edges.extend([(0.9, 'b', 'c'), (0.7, 'c', 'a')])
+        self.assertListEqual([0, 1, 2], list(edges.u))
+        self.assertListEqual(['a', 'b', 'c'], edges.labels.labels)
+        merges = clusters.single_linkage(edges, 'ge')
+        self.assertListEqual([(0.9, 'b', 'c', 1, 1), (0.7, 'c', 'a', 2, 1)], merges)
+
+    def test_edge_order(self):
+        rng = random.Random(0xc1a55)
+        weights = array.array('d', [rng.choice([0.1, 0.25, 0.5, 0.75]) for _ in range(100)])
+        original_chunk_size = clusters._EDGE_SORT_CHUNK_SIZE
+        for reverse in (False, True):
+            expected = sorted(range(len(weights)), key=weights.__getitem__, reverse=reverse)
+            with self.subTest(reverse=reverse, numpy=True):
+                self.assertListEqual(expected, [int(k) for k in clusters._edge_order(weights, reverse)])
+            with self.subTest(reverse=reverse, numpy=False):
+                with unittest.mock.patch.dict('sys.modules', {'numpy': None}):
+                    try:
+                        clusters._EDGE_SORT_CHUNK_SIZE = 7
+                        self.assertListEqual(expected, list(clusters._edge_order(weights, reverse)))
+                    finally:
+                        clusters._EDGE_SORT_CHUNK_SIZE = original_chunk_size
+
+    def test_main_merge_tree(self):
+        text = "0.9,a,b\n0.8,b,c\n0.7,a,c\n0.1,c,d\n"
+        buffer = io.StringIO()
+        exit_code = clusters.main(['--merge-tree'], io.StringIO(text), buffer)
+        self.assertEqual(0, exit_code)
+        self.assertListEqual(["0.9,a,b,1,1", "0.8,b,c,2,1", "0.1,c,d,3,1"], buffer.getvalue().splitlines())
+
+    def test_main_sweep(self):
+        text = "0.9,a,b\n0.8,b,c\n0.7,d,e\n0.1,c,d\n"
+        buffer = io.StringIO()
+        clusters.main(['--sweep', '0.85,0.5,0'], io.StringIO(text), buffer)
+        self.assertListEqual(["0.85,1,2", "0.5,2,3", "0.0,1,5"], buffer.getvalue().splitlines())
+
+
+class StateTest(TestCase):
+
+    def test_save_load(self):
+        d = DisjointSet()
+        d.update([('a', 'b'), ('c', 'd'), ('b', 'ü')])
+        buffer = io.BytesIO()
+        clusters.save_state(d, buffer, 'gt', 0.5)
+        loaded, comparison, threshold = clusters.load_state(io.BytesIO(buffer.getvalue()))
+        self.assertEqual(('gt', 0.5), (comparison, threshold))
+        self.assertSetEqual(set(d.components()), set(loaded.components()))
+        self.assertListEqual(list(d.size), list(loaded.size))
+
+    def test_main_incremental(self):
+        days = ["0.9,a,b\n0.1,b,c\n", "0.8,c,d\n0.7,e,f\n", "0.6,b,d\n"]
+        with tempfile.TemporaryDirectory() as tempdir:
+            state_file = os.path.join(tempdir, 'clusters.state')
+            outputs = []
+            for day in days:
+                buffer = io.StringIO()
+                self.assertEqual(0, clusters.main(['-t', '0.5', '--state', state_file], io.StringIO(day), buffer))
+                outputs.append(buffer.getvalue())
+            stderr = io.StringIO()
+            with contextlib.redirect_stderr(stderr):
+                exit_code = clusters.main(['-t', '0.2', '--state', state_file], io.StringIO(""), io.StringIO())
+            self.assertEqual(1, exit_code)
+        self.assertTrue(outputs[0].startswith("2: "))
+        self.assertTrue(outputs[1].startswith("2: "))
+        self.assertTrue(outputs[2].startswith("4: "))
+        self.assertSetEqual(set("abcd"), set(outputs[2].split(": ")[1].split()))
+
+
+class MultipleFilesTest(TestCase):
+
+    def test_process_files(self):
+        rng = random.Random(0xf11e5)
+        vertexes = [f"v{i}" for i in range(300)]
+        with tempfile.TemporaryDirectory() as tempdir:
+            pathnames = []
+            for k in range(4):
+                pathname = os.path.join(tempdir, f"edges-{k}.csv")
+                with open(pathname, 'w') as ofile:
+                    for _ in range(100):
+                        print(f"{rng.random():.3f},{rng.choice(vertexes)},{rng.choice(vertexes)}", file=ofile)
+                pathnames.append(pathname)
+            text = ''
+            for pathname in pathnames:
+                with open(pathname, 'r') as ifile:
+                    text += ifile.read()
+            expected = clusters.process(io.StringIO(text), EdgeParser(), clusters.make_weight_filter('ge', 0.3))
+            actual = clusters.process_files(pathnames, EdgeParser(), 'ge', 0.3, 2)
+            self.assertSetEqual(set(expected), set(actual))
+            sequential, parallel = io.StringIO(), io.StringIO()
+            clusters.main(['-t', '0.3', '-j', '1'] + pathnames, ofile=sequential)
+            clusters.main(['-t', '0.3', '-j', '2'] + pathnames, ofile=parallel)
+            self.assertEqual(set(sequential.getvalue().split()), set(parallel.getvalue().split()))
+
+    def test_main_stdin_with_files(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pathname = os.path.join(tempdir, 'edges.csv')
+            with open(pathname, 'w') as ofile:
+                ofile.write("0.9,a,b\n0.1,b,c\n")
+            for jobs in ('1', '2'):
+                with self.subTest(jobs=jobs):
+                    buffer = io.StringIO()
+                    exit_code = clusters.main(['-t', '0.5', '-j', jobs, pathname, '-'], io.StringIO("0.8,b,c\n0.7,d,e\n"), buffer)
+                    self.assertEqual(0, exit_code)
+                    self.assertEqual("3: ", buffer.getvalue()[:3])
+                    self.assertSetEqual(set("abc"), set(buffer.getvalue().splitlines()[0][3:].split()))
+
+    def test_main_jobs_must_be_positive(self):
+        for jobs in ('0', '-1'):
+            with self.subTest(jobs=jobs):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    with self.assertRaises(SystemExit) as cm:
+                        clusters.main(['-j', jobs, 'a.csv', 'b.csv'], io.StringIO(), io.StringIO())
+                self.assertEqual(2, cm.exception.code)
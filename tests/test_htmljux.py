@@ -1,5 +1,8 @@
 import io
 import re
+import csv
+import json
+import random
 import jinja2
 import os.path
 import logging
@@ -124,6 +127,306 @@ A,B,C,D,E,F,G,H,I
             self.assertEqual(0, exit_code)
 
 
+    def test_main_pages(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w') as ofile:
+                for i in range(23):
+                    print(f"caption{i},/images/{i}.jpg", file=ofile)
+            output_dir = os.path.join(tmpdir, "pages")
+            exit_code = htmljux.main(["--caption", "0", "--page-size", "10", "--output-dir", output_dir, "-j", "2", csv_file])
+            self.assertEqual(0, exit_code)
+            self.assertListEqual([".htmljux-manifest.json", "index.html", "page-00001.html", "page-00002.html", "page-00003.html"], sorted(os.listdir(output_dir)))
+            with open(os.path.join(output_dir, "page-00002.html"), 'r') as ifile:
+                html = ifile.read()
+            with open(os.path.join(output_dir, "index.html"), 'r') as ifile:
+                index_html = ifile.read()
+            with open(os.path.join(output_dir, "page-00003.html"), 'r') as ifile:
+                last_html = ifile.read()
+        self.assertIn('href="page-00001.html"', html)
+        self.assertIn('href="page-00003.html"', html)
+        self.assertIn('caption10', html)
+        self.assertIsNone(re.search(r'caption9\s', html))
+        self.assertIn('rows 20 to 22', index_html)
+        self.assertNotIn('>next<', last_html)
+
+    def test_main_pages_incremental(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_file = os.path.join(tmpdir, "input.csv")
+            def append_rows(start, stop):
+                with open(csv_file, 'a') as ofile:
+                    for i in range(start, stop):
+                        print(f"caption{i},/images/{i}.jpg", file=ofile)
+            def page_mtimes():
+                return {name: os.stat(os.path.join(output_dir, name)).st_mtime_ns for name in os.listdir(output_dir) if name.startswith("page-")}
+            output_dir = os.path.join(tmpdir, "pages")
+            argl = ["--caption", "0", "--page-size", "10", "--output-dir", output_dir, "-j", "2", csv_file]
+            append_rows(0, 35)
+            self.assertEqual(0, htmljux.main(argl))
+            before = page_mtimes()
+            for name in before:
+                os.utime(os.path.join(output_dir, name), ns=(0, 0))
+            append_rows(35, 45)
+            self.assertEqual(0, htmljux.main(argl))
+            after = page_mtimes()
+            self.assertSetEqual({"page-00001.html", "page-00002.html", "page-00003.html", "page-00004.html", "page-00005.html"}, set(after))
+            self.assertSetEqual({"page-00004.html", "page-00005.html"}, {name for name, mtime in after.items() if mtime != 0})
+            with open(os.path.join(output_dir, "page-00004.html"), 'r') as ifile:
+                self.assertIn('href="page-00005.html"', ifile.read())
+            with open(csv_file, 'w') as ofile:
+                pass
+            append_rows(0, 15)
+            self.assertEqual(0, htmljux.main(argl))
+            self.assertSetEqual({"page-00001.html", "page-00002.html"}, set(page_mtimes()))
+            self.assertEqual(0, page_mtimes()["page-00001.html"])
+            self.assertEqual(0, htmljux.main(argl + ["--rebuild"]))
+            self.assertNotEqual(0, page_mtimes()["page-00001.html"])
+
+    def test_main_custom_template_cached(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w') as ofile:
+                print("a&b,/images/0.jpg", file=ofile)
+            template_file = os.path.join(tmpdir, "custom.html")
+            with open(template_file, 'w') as ofile:
+                ofile.write("{% for row in rows %}<p>{{ row.caption }}</p>{% endfor %}")
+            cache_dir = os.path.join(tmpdir, "cache")
+            argl = ["--caption", "0", "--template", template_file, "--template-cache", cache_dir, csv_file]
+            buffer = io.StringIO()
+            exit_code = htmljux.main(argl, stdout=buffer)
+            self.assertEqual(0, exit_code)
+            self.assertEqual("<p>a&amp;b</p>", buffer.getvalue().strip())
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+            htmljux._ENVIRONMENTS.clear()
+            buffer = io.StringIO()
+            exit_code = htmljux.main(argl, stdout=buffer)
+            self.assertEqual(0, exit_code)
+            self.assertEqual("<p>a&amp;b</p>", buffer.getvalue().strip())
+
+    def test_main_batch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_files = []
+            for name in ("first", "second"):
+                csv_file = os.path.join(tmpdir, name + ".csv")
+                with open(csv_file, 'w') as ofile:
+                    print(f"{name}-caption,/images/{name}.jpg", file=ofile)
+                csv_files.append(csv_file)
+            output_dir = os.path.join(tmpdir, "out")
+            exit_code = htmljux.main(["--caption", "0", "--batch", output_dir, "--template-cache", os.path.join(tmpdir, "cache")] + csv_files)
+            self.assertEqual(0, exit_code)
+            self.assertListEqual(["first.html", "second.html"], sorted(os.listdir(output_dir)))
+            with open(os.path.join(output_dir, "second.html"), 'r') as ifile:
+                html = ifile.read()
+        self.assertIn("second-caption", html)
+        self.assertNotIn("first-caption", html)
+
+    def test_main_virtual(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w') as ofile:
+                print("</script><b>,/images/0.jpg", file=ofile)
+                print("plain,/images/1.jpg", file=ofile)
+            buffer = io.StringIO()
+            exit_code = htmljux.main(["--caption", "0", "--mode", "virtual", "--row-height", "100", csv_file], stdout=buffer)
+        self.assertEqual(0, exit_code)
+        html = buffer.getvalue()
+        self.assertNotIn("</script><b>", html)
+        match = re.search(r'<script id="rows" type="application/json">(.*?)</script>', html, re.DOTALL)
+        rows = json.loads(match.group(1))
+        self.assertListEqual([
+            ["</script><b>", [["file:///images/0.jpg", "0.jpg", None, None, None]]],
+            ["plain", [["file:///images/1.jpg", "1.jpg", None, None, None]]],
+        ], rows)
+        self.assertIn('loading = "lazy"', html)
+        self.assertIn("height: 100px", html)
+
+    def test_main_virtual_rejects_template(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w') as ofile:
+                print("plain,/images/1.jpg", file=ofile)
+            template_file = os.path.join(tmpdir, "page.html")
+            with open(template_file, 'w') as ofile:
+                print("<html>{{ rows }}</html>", file=ofile)
+            stdout, stderr = io.StringIO(), io.StringIO()
+            exit_code = htmljux.main(["--caption", "0", "--mode", "virtual", "--template", template_file, csv_file], stdout=stdout, stderr=stderr)
+        self.assertEqual(1, exit_code)
+        self.assertEqual("", stdout.getvalue())
+        self.assertIn("--template is not supported", stderr.getvalue())
+
+    def test_main_batch_without_inputs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stderr = io.StringIO()
+            exit_code = htmljux.main(["--batch", tmpdir], stderr=stderr)
+            self.assertListEqual([], os.listdir(tmpdir))
+        self.assertEqual(1, exit_code)
+        self.assertIn("requires input files", stderr.getvalue())
+
+    def test_main_multiple_inputs_without_batch(self):
+        stderr = io.StringIO()
+        exit_code = htmljux.main(["a.csv", "b.csv"], stderr=stderr)
+        self.assertEqual(1, exit_code)
+        self.assertIn("--batch", stderr.getvalue())
+
+
+class ThumbnailerTest(TestCase):
+
+    def test_thumbnails(self):
+        from PIL import Image as PILImage
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_paths = []
+            for i, mode in enumerate(['RGB', 'RGBA']):
+                source_path = os.path.join(tmpdir, f"image{i}." + ('jpg' if mode == 'RGB' else 'png'))
+                PILImage.new(mode, (400, 200), 'red').save(source_path)
+                source_paths.append(source_path)
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w') as ofile:
+                print(f"a,{source_paths[0]},{source_paths[1]},{os.path.join(tmpdir, 'missing.jpg')}", file=ofile)
+            cache_dir = os.path.join(tmpdir, "cache")
+            argl = ["--caption", "0", "--thumbnails", "50", "--thumbnail-cache", cache_dir, "-j", "2", csv_file]
+            buffer = io.StringIO()
+            self.assertEqual(0, htmljux.main(argl, stdout=buffer))
+            thumbnails = sorted(os.listdir(cache_dir))
+            self.assertEqual(2, len(thumbnails))
+            for thumbnail in thumbnails:
+                with PILImage.open(os.path.join(cache_dir, thumbnail)) as im:
+                    self.assertEqual((50, 25), im.size)
+                    self.assertEqual('JPEG', im.format)
+            html = buffer.getvalue()
+            mtimes = [os.stat(os.path.join(cache_dir, t)).st_mtime_ns for t in thumbnails]
+            rerun = io.StringIO()
+            self.assertEqual(0, htmljux.main(argl, stdout=rerun))
+            self.assertListEqual(mtimes, [os.stat(os.path.join(cache_dir, t)).st_mtime_ns for t in thumbnails])
+        for thumbnail in thumbnails:
+            self.assertIn(thumbnail, html)
+        self.assertIn('href="file://' + source_paths[0] + '"', html)
+        self.assertIn('missing.jpg', html)
+        self.assertEqual(html, rerun.getvalue())
+
+
+class ImageSizerTest(TestCase):
+
+    def test_image_sizes(self):
+        from PIL import Image as PILImage
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_path = os.path.join(tmpdir, "image.png")
+            PILImage.new('RGB', (40, 30), 'red').save(source_path)
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w') as ofile:
+                print(f"a,{source_path},{os.path.join(tmpdir, 'missing.jpg')}", file=ofile)
+            index_file = os.path.join(tmpdir, "cache", "sizes.tsv")
+            argl = ["--caption", "0", "--image-sizes", "--image-size-index", index_file, csv_file]
+            buffer = io.StringIO()
+            self.assertEqual(0, htmljux.main(argl, stdout=buffer))
+            with open(index_file, 'r') as ifile:
+                index_lines = ifile.readlines()
+            self.assertListEqual([f"40\t30\t{os.stat(source_path).st_mtime_ns}\t{os.stat(source_path).st_size}\t{source_path}\n"], index_lines)
+            rerun = io.StringIO()
+            self.assertEqual(0, htmljux.main(argl, stdout=rerun))
+            with open(index_file, 'r') as ifile:
+                self.assertListEqual(index_lines, ifile.readlines())
+        html = buffer.getvalue()
+        self.assertEqual(1, html.count('width="40" height="30"'))
+        self.assertEqual(html, rerun.getvalue())
+
+    def test_rewrites_superseded_entries(self):
+        from PIL import Image as PILImage
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_path = os.path.join(tmpdir, "image.png")
+            index_file = os.path.join(tmpdir, "sizes.tsv")
+            for size in [(40, 30), (20, 10), (8, 6)]:
+                PILImage.new('RGB', size, 'red').save(source_path)
+                os.utime(source_path, ns=(size[0], size[0]))
+                row = htmljux.Row("a", [htmljux.Image("file://" + source_path, "image.png", source_path)])
+                with htmljux.ImageSizer(index_file) as sizer:
+                    image = list(sizer.apply([row]))[0].images[0]
+                self.assertEqual(size, (image.width, image.height))
+                with open(index_file, 'r') as ifile:
+                    self.assertEqual(1, len(ifile.readlines()))
+
+    def test_uses_index_without_opening_images(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_path = os.path.join(tmpdir, "image.jpg")
+            with open(source_path, 'wb') as ofile:
+                ofile.write(b'not an image')
+            stat = os.stat(source_path)
+            index_file = os.path.join(tmpdir, "sizes.tsv")
+            with open(index_file, 'w') as ofile:
+                print(7, 5, stat.st_mtime_ns, stat.st_size, source_path, sep="\t", file=ofile)
+            row = htmljux.Row("a", [htmljux.Image("file://" + source_path, "image.jpg", source_path)])
+            with htmljux.ImageSizer(index_file, jobs=2) as sizer:
+                rows = list(sizer.apply([row]))
+        self.assertEqual((7, 5), (rows[0].images[0].width, rows[0].images[0].height))
+
+
+class RowIndexTest(TestCase):
+
+    def test_build_and_read_rows(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w', newline='') as ofile:
+                writer = csv.writer(ofile)
+                writer.writerows([["3", "c.jpg"], ["1", "a\nmultiline.jpg"], ["skipped", "x.jpg"], ["2", "b\u00e9.jpg"]])
+            extractor = htmljux.Extractor(0, csv_args={})
+            sort_spec = htmljux.make_sort_key("numeric", 0)
+            pre_predicate = htmljux.make_row_pre_filter(redaction_filter=lambda cell: cell != "skipped")
+            row_index = htmljux.RowIndex.build(csv_file, extractor, pre_predicate, sort_spec)
+            self.assertEqual(3, len(row_index))
+            self.assertListEqual([["1", "a\nmultiline.jpg"], ["2", "b\u00e9.jpg"], ["3", "c.jpg"]], row_index.read_rows(0, 3))
+            self.assertListEqual([["3", "c.jpg"]], row_index.read_rows(2, 3))
+
+
+class PreviewServerTest(TestCase):
+
+    def test_serve(self):
+        import threading
+        import urllib.request
+        import urllib.error
+        from PIL import Image as PILImage
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "image.png")
+            PILImage.new('RGB', (400, 200), 'red').save(image_path)
+            csv_file = os.path.join(tmpdir, "input.csv")
+            with open(csv_file, 'w') as ofile:
+                for i in range(25):
+                    print(f"caption{i},{image_path}", file=ofile)
+            extractor = htmljux.Extractor(0, src_transform=make_transform())
+            row_index = htmljux.RowIndex.build(csv_file, extractor)
+            cache_dir = os.path.join(tmpdir, "cache")
+            thumbnailer = htmljux.Thumbnailer(50, cache_dir)
+            previewer = htmljux.Previewer(row_index, extractor, 10, thumbnailer=thumbnailer)
+            with htmljux.make_preview_server(previewer, 0) as server:
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                try:
+                    base_url = "http://%s:%d" % server.server_address[:2]
+                    def fetch(path):
+                        with urllib.request.urlopen(base_url + path) as response:
+                            return response.headers.get_content_type(), response.read()
+                    _, index_html = fetch("/")
+                    _, page_html = fetch("/page-00003.html")
+                    self.assertFalse(os.path.exists(cache_dir))
+                    thumbnail_type, thumbnail = fetch("/thumbnail/20/0")
+                    image_type, image = fetch("/image/20/0")
+                    with self.assertRaises(urllib.error.HTTPError) as cm:
+                        fetch("/page-00004.html")
+                    self.assertEqual(404, cm.exception.code)
+                finally:
+                    server.shutdown()
+                    thread.join()
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+            with open(image_path, 'rb') as ifile:
+                self.assertEqual(ifile.read(), image)
+        self.assertIn(b'href="page-00003.html"', index_html)
+        self.assertIn(b'rows 20 to 24', index_html)
+        self.assertIn(b'caption24', page_html)
+        self.assertNotIn(b'caption19', page_html)
+        self.assertIn(b'src="/thumbnail/20/0"', page_html)
+        self.assertIn(b'href="/image/20/0"', page_html)
+        self.assertEqual("image/jpeg", thumbnail_type)
+        self.assertEqual("image/png", image_type)
+
+
 class RowFiltersTest(TestCase):
 
     def setUp(self):
@@ -228,6 +531,15 @@ class ExtractorTest(TestCase):
         sorted_rows = list(map(operator.itemgetter(1), htmljux.Extractor()._enumerate_rows(io.StringIO(csv_text), None, sort_key, None)))
         self.assertListEqual([['1', 'x', 'y'], ['5', 'j', 'k'], ['10', 'a', 'b']], sorted_rows)
 
+    def test__enumerate_rows_sort_numeric_header(self):
+        csv_text = "score,name\n10,a\nn/a,b\n1,x\n5,j\n"
+        for sort_key_def, expected in (('numeric:0', ['score', 'n/a', '1', '5', '10']),
+                                       ('-numeric:0', ['score', 'n/a', '10', '5', '1'])):
+            with self.subTest(sort=sort_key_def):
+                sort_spec = htmljux.make_sort_key(sort_key_def, None)
+                erows = htmljux.Extractor()._enumerate_rows(io.StringIO(csv_text), None, sort_spec, None)
+                self.assertListEqual(expected, [row[0] for _, row in erows])
+
     def test__enumerate_rows_sort_and_limit(self):
         csv_text = """\
 10,a,b
@@ -242,6 +554,46 @@ class ExtractorTest(TestCase):
         self.assertListEqual([['10', 'a', 'b'], ['5', 'j', 'k']], sorted_rows)
 
 
+    def test_extract_lazy(self):
+        lines_read = []
+        def lines():
+            for i in range(1000):
+                lines_read.append(i)
+                yield f"caption{i},/images/{i}.jpg\n"
+        rows = htmljux.Extractor(0).extract(lines())
+        first = next(rows)
+        self.assertEqual('caption0', first.caption)
+        self.assertLessEqual(len(lines_read), 2)
+
+    def test_extract_limit_without_sort(self):
+        csv_text = "a,/x.jpg\nb,/y.jpg\nc,/z.jpg\n"
+        rows = list(htmljux.Extractor(0).extract(io.StringIO(csv_text), None, None, htmljux.make_row_post_filter(2)))
+        self.assertListEqual(['a', 'b'], [row.caption for row in rows])
+
+    def test_extract_limit_stops_reading(self):
+        lines = iter(["a,/x.jpg\n", "b,/y.jpg\n"])
+        def ifile():
+            yield from lines
+            raise AssertionError("read past limit")
+        rows = list(htmljux.Extractor(0).extract(ifile(), None, None, htmljux.make_row_post_filter(2)))
+        self.assertListEqual(['a', 'b'], [row.caption for row in rows])
+
+    def test__enumerate_rows_heap_matches_sort(self):
+        rng = random.Random(0x40b)
+        tokens = ['1', '2', '2.0', '3', '10', 'x', '', '-1', 'nan']
+        csv_text = "".join(f"{rng.choice(tokens)},{i}\n" for i in range(200))
+        for sort_key_def in ('numeric:0', '-numeric:0', 'lex:0', '-lex:0'):
+            for limit in (0, 1, 7, 50, 500):
+                with self.subTest(sort=sort_key_def, limit=limit):
+                    sort_spec = htmljux.make_sort_key(sort_key_def, None)
+                    sort_key, reverse = sort_spec
+                    all_rows = list(csv.reader(io.StringIO(csv_text)))
+                    expected = sorted(all_rows, key=sort_key, reverse=reverse)[:limit]
+                    post_predicate = htmljux.make_row_post_filter(limit)
+                    erows = htmljux.Extractor()._enumerate_rows(io.StringIO(csv_text), None, sort_spec, post_predicate)
+                    self.assertListEqual(expected, list(map(operator.itemgetter(1), erows)))
+
+
 class RendererTest(TestCase):
 
     def test_render_css(self):
@@ -267,4 +619,7 @@ class RendererTest(TestCase):
         page_model = htmljux.PageModel(rows)
         html = renderer.render(page_model)
         if css:
-            self.assertIn(css, html)
\ No newline at end of file
+            self.assertIn(css, html)
+        buffer = io.StringIO()
+        renderer.stream(htmljux.PageModel(iter(rows)), buffer)
+        self.assertEqual(html, buffer.getvalue())
\ No newline at end of file
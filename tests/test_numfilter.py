@@ -2,8 +2,13 @@
 
 from unittest import TestCase
 
-import csv
 import io
+import os
+import csv
+import random
+import contextlib
+import itertools
+import tempfile
 from calculation import numfilter
 
 
@@ -26,4 +31,253 @@ class ModuleMethodsTest(TestCase):
         output_rows = [row for row in csv.reader(io.StringIO(buffer.getvalue()))]
         self.assertSetEqual({'a', 'c', 'd', 'f'}, set(row[1] for row in output_rows))
 
+    def test_expression(self):
+        test_cases = [
+            # expression, row, expected
+            ('c0 >= 0.5', ['0.5'], True),
+            ('c0 > 0.5', ['0.5'], False),
+            ('c1 < c0', ['2', '1'], True),
+            ('c0 == 1 and c1 != 1', ['1', '2'], True),
+            ('c0 == 1 and c1 != 1', ['1', '1'], False),
+            ('c3 >= 0.5 and (c7 < 10 or c2 != 0)', ['x', 'x', '0', '0.7', 'x', 'x', 'x', '12'], False),
+            ('c3 >= 0.5 and (c7 < 10 or c2 != 0)', ['x', 'x', '1', '0.7', 'x', 'x', 'x', '12'], True),
+            ('c0 < 0 or c1 > 1', ['-1', 'not a number'], True),
+            ('not (c0 < 0)', ['1'], True),
+            ('c0 <= -1e3', ['-1000'], True),
+        ]
+        for text, row, expected in test_cases:
+            with self.subTest(expression=text, row=row):
+                self.assertIs(expected, numfilter.Expression(text)(row))
+
+    def test_expression_epsilon(self):
+        e = numfilter.Expression('c0 == 1', 0.01)
+        self.assertTrue(e(['1.005']))
+        self.assertFalse(e(['1.05']))
+
+    def test_expression_syntax_error(self):
+        for text in ['', 'c0 >=', 'c0 >= 1 and', '(c0 > 1', 'c0 > 1)', 'x0 > 1', 'c0 1']:
+            with self.subTest(expression=text):
+                with self.assertRaises(numfilter.ExpressionSyntaxError):
+                    numfilter.Expression(text)
+
+    def test_main_expression(self):
+        input_text = "0.2,a,1\n-0.2,b,1\n0.4,c,0\nx,d,1\n"
+        buffer = io.StringIO()
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(input_text)
+            exit_code = numfilter.main(['-x', 'c0 > 0 and c2 == 1', input_file], buffer)
+        self.assertEqual(0, exit_code)
+        output_rows = [row for row in csv.reader(io.StringIO(buffer.getvalue()))]
+        self.assertListEqual([['0.2', 'a', '1']], output_rows)
+
+    def test_filter_blocks(self):
+        input_text = "0.2,a\n-0.2,b\nx,c\n0.1,d\n\n0.3\n0.11,f\n,g\n"
+        for operator in ('ge', 'gt', 'le', 'lt', 'eq', 'ne'):
+            for error_reaction in ('include', 'exclude', 'auto'):
+                with self.subTest(operator=operator, errors=error_reaction):
+                    f = numfilter.Filter(0.1, operator, 0.015)
+                    expected, actual = io.StringIO(), io.StringIO()
+                    expected_code = numfilter.do_filter(io.StringIO(input_text), f, expected, error_reaction=error_reaction)
+                    actual_code = numfilter.filter_blocks(io.StringIO(input_text), f, actual, block_size=3, error_reaction=error_reaction)
+                    self.assertEqual(expected.getvalue(), actual.getvalue())
+                    self.assertEqual(expected_code, actual_code)
+
+    def test_split_ranges(self):
+        lines = [f"{i / 7:.3f},{'x' * (i % 5)}\n" for i in range(50)]
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(''.join(lines))
+            ranges = numfilter.split_ranges(input_file, 7)
+            with open(input_file, 'rb') as ifile:
+                content = ifile.read()
+        self.assertEqual(0, ranges[0][0])
+        self.assertEqual(len(content), ranges[-1][1])
+        for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(b"\n", content[start - 1:start])
+
+    def test_split_ranges_quoted_line_breaks(self):
+        quoted = '"' + "\n".join(f"line {i}, quoted" for i in range(200)) + '"'
+        lines = [f"0.5,{quoted}\n"] + [f"{(i * 37 % 101) / 100:.2f},\"x\"\"{i}\"\n" for i in range(100)] + [f"0.7,{quoted}\n", "0.9,last\n"]
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(''.join(lines))
+            record_starts = set(itertools.accumulate([0] + [len(line.encode('utf-8')) for line in lines]))
+            for num_ranges in (2, 4, 13, 500):
+                with self.subTest(num_ranges=num_ranges):
+                    ranges = numfilter.split_ranges(input_file, num_ranges)
+                    self.assertTrue(all(start in record_starts for start, _ in ranges))
+                    self.assertGreater(len(ranges), 1)
+            expected, actual = io.StringIO(), io.StringIO()
+            self.assertEqual(0, numfilter.main(['-t', '0.3', input_file], expected))
+            self.assertEqual(0, numfilter.main(['-j', '4', '-t', '0.3', input_file], actual))
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_split_ranges_follows_reader_quote_rules(self):
+        rng = random.Random(0x5eed)
+        templates = [
+            '{v},a 5" screen\n',
+            '{v},"quoted\nwith ""escaped"" quote\nand, comma"\n',
+            '{v},"closed"then" stray\n',
+            '{v},plain\r\n',
+            '{v},""\n',
+            '"{v}","x\n\n"\n',
+        ]
+        lines = [rng.choice(templates).format(v=f"{rng.random():.3f}") for _ in range(300)]
+        self.assertEqual(len(lines), len(list(csv.reader(io.StringIO(''.join(lines), newline='')))))
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w', newline='') as ofile:
+                ofile.write(''.join(lines))
+            record_starts = set(itertools.accumulate([0] + [len(line.encode('utf-8')) for line in lines]))
+            for num_ranges in (3, 17, 1000):
+                with self.subTest(num_ranges=num_ranges):
+                    ranges = numfilter.split_ranges(input_file, num_ranges)
+                    self.assertTrue(all(start in record_starts for start, _ in ranges))
+                    self.assertGreater(len(ranges), 2)
+            expected, actual = io.StringIO(), io.StringIO()
+            numfilter.main(['-t', '0.3', input_file], expected)
+            numfilter.main(['-j', '4', '-t', '0.3', input_file], actual)
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_main_jobs(self):
+        lines = [f"{(i * 37 % 101) / 100:.2f},{i}\n" for i in range(200)] + ["x,bad\n"]
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(''.join(lines))
+            for argl in [['-t', '0.5'], ['-t', '0.5', '--block-size', '7'], ['-x', 'c0 > 0.3 and c1 < 150'], ['-t', '0.5', '--errors', 'include']]:
+                with self.subTest(args=argl):
+                    expected, actual = io.StringIO(), io.StringIO()
+                    argl = argl + [input_file]
+                    expected_code = numfilter.main(argl, expected)
+                    actual_code = numfilter.main(['-j', '3'] + argl, actual)
+                    self.assertEqual(expected.getvalue(), actual.getvalue())
+                    self.assertEqual(expected_code, actual_code)
+
+    def test_do_filter_passthrough(self):
+        input_text = '0.2,"a"\n-0.2,b\n"0.4","multi\nline, quoted"\n0.1,  d  \r\n0.3,e'
+        buffer = io.StringIO()
+        f = numfilter.Filter(0.05, 'ge', None)
+        numfilter.do_filter(io.StringIO(input_text), f, buffer)
+        self.assertEqual('0.2,"a"\n"0.4","multi\nline, quoted"\n0.1,  d  \r\n0.3,e\n', buffer.getvalue())
+
+    def test_do_filter_change_delimiter(self):
+        input_text = '0.2,"a"\n-0.2,b\n0.4,"c\td"\n'
+        buffer = io.StringIO()
+        f = numfilter.Filter(0.05, 'ge', None)
+        numfilter.do_filter(io.StringIO(input_text), f, buffer, output_delimiter="\t")
+        self.assertEqual('0.2\ta\r\n0.4\t"c\td"\r\n', buffer.getvalue())
+
+    def test_filter_indexed(self):
+        rng = random.Random(0x5eed)
+        lines = [f"{rng.choice(['0.1', '0.25', '0.5', '-1', 'nan', 'x', ''])},{i}\n" for i in range(300)]
+        lines[7] = '0.5,"multi\nline"\n'
+        lines[8] = '0.1\n'
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(''.join(lines))
+            self.assertEqual(0, numfilter.main(['--build-index', '0', input_file]))
+            with numfilter.open_index(input_file, 0, ',') as index:
+                self.assertEqual(300, index.nrows)
+                self.assertListEqual(sorted(index.values), list(index.values))
+            for operator in ('ge', 'gt', 'le', 'lt', 'eq', 'ne'):
+                for error_reaction in ('include', 'exclude'):
+                    with self.subTest(operator=operator, errors=error_reaction):
+                        f = numfilter.Filter(0.25, operator, 0.1)
+                        expected, actual = io.StringIO(), io.StringIO()
+                        with open(input_file, 'r') as ifile:
+                            expected_code = numfilter.do_filter(ifile, f, expected, error_reaction=error_reaction)
+                        with numfilter.open_index(input_file, 0, ',') as index:
+                            actual_code = numfilter.filter_indexed(input_file, index, f, actual, error_reaction=error_reaction)
+                        self.assertEqual(expected.getvalue(), actual.getvalue())
+                        self.assertEqual(expected_code, actual_code)
+            self.assertIsNone(numfilter.open_index(input_file, 1, ','))
+            with open(input_file, 'a') as ofile:
+                ofile.write("0.9,appended\n")
+            self.assertIsNone(numfilter.open_index(input_file, 0, ','))
+
+    def test_top_and_bottom(self):
+        input_text = "0.3,a\n0.9,b\nx,c\n0.1,d\n0.9,e\n0.5,f\n0.1,g\n"
+        test_cases = [
+            # args, expected labels
+            (['--top', '2'], ['b', 'e']),
+            (['--top', '3'], ['b', 'e', 'f']),
+            (['--top', '3', '--errors', 'include'], ['b', 'c', 'e', 'f']),
+            (['--bottom', '1'], ['d']),
+            (['--bottom', '3'], ['a', 'd', 'g']),
+            (['--top', '100'], ['a', 'b', 'd', 'e', 'f', 'g']),
+            (['--top', '0'], []),
+        ]
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(input_text)
+            for argl, expected in test_cases:
+                with self.subTest(args=argl):
+                    buffer = io.StringIO()
+                    numfilter.main(argl + [input_file], buffer)
+                    output_rows = [row for row in csv.reader(io.StringIO(buffer.getvalue()))]
+                    self.assertListEqual(expected, [row[1] for row in output_rows])
+
+    def test_above_percentile(self):
+        lines = [f"{(i * 37) % 100},{i}\n" for i in range(100)] + ["x,bad\n"]
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(''.join(lines))
+            with open(input_file, 'r') as ifile:
+                self.assertEqual(89.0, numfilter.find_percentile(ifile, 90))
+            buffer = io.StringIO()
+            numfilter.main(['--above-percentile', '90', input_file], buffer)
+        output_values = [float(row[0]) for row in csv.reader(io.StringIO(buffer.getvalue()))]
+        self.assertListEqual(sorted(output_values), sorted(range(90, 100)))
+
+    def test_expression_option_conflicts(self):
+        for argl in (['-t', '100'], ['-p', 'lt'], ['-c', '1']):
+            with self.subTest(argl=argl):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    with self.assertRaises(SystemExit) as cm:
+                        numfilter.main(['-x', 'c0 > 2'] + argl + ['input.csv'], io.StringIO())
+                self.assertEqual(2, cm.exception.code)
+
+    def test_ranking_option_conflicts(self):
+        for argl in (['--above-percentile', '90', '-t', '0.5'], ['--above-percentile', '90', '-p', 'lt'],
+                     ['--top', '3', '-j', '2'], ['--bottom', '3', '--block-size', '10']):
+            with self.subTest(argl=argl):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    with self.assertRaises(SystemExit) as cm:
+                        numfilter.main(argl + ['input.csv'], io.StringIO())
+                self.assertEqual(2, cm.exception.code)
+
+    def test_split_option_conflicts(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pattern = os.path.join(tempdir, 'out-%d.csv')
+            for argl in (['-t', '0.5'], ['-p', 'lt'], ['-x', 'c0 > 2'], ['--top', '3'], ['--bottom', '3'],
+                         ['-j', '2'], ['--block-size', '10']):
+                with self.subTest(argl=argl):
+                    with contextlib.redirect_stderr(io.StringIO()):
+                        with self.assertRaises(SystemExit) as cm:
+                            numfilter.main(['--split-at', '0.5', '--output-pattern', pattern] + argl + ['input.csv'], io.StringIO())
+                    self.assertEqual(2, cm.exception.code)
+            self.assertListEqual([], os.listdir(tempdir))
 
+    def test_main_split(self):
+        input_text = '0.05,a\n0.1,b\nx,c\n0.7,"d,e"\n0.95,f\n0.5,g\n-1,h\n'
+        with tempfile.TemporaryDirectory() as tempdir:
+            input_file = os.path.join(tempdir, 'input.csv')
+            with open(input_file, 'w') as ofile:
+                ofile.write(input_text)
+            pattern = os.path.join(tempdir, 'out-%d.csv')
+            exit_code = numfilter.main(['--split-at', '0.1,0.5,0.9', '--output-pattern', pattern, input_file])
+            self.assertEqual(0, exit_code)
+            contents = []
+            for i in range(4):
+                with open(pattern % i, 'r') as ifile:
+                    contents.append(ifile.read())
+        self.assertListEqual(['0.05,a\n-1,h\n', '0.1,b\n', '0.7,"d,e"\n0.5,g\n', '0.95,f\n'], contents)
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
+import io
+import os
 import random
+import tempfile
+import unittest.mock
 from unittest import TestCase
 
+from shelltools import ressample
 from shelltools.ressample import ReservoirSampler
 
 _TEST_SEED = 0xDeadBeef
@@ -41,3 +46,32 @@ class ReservoirSamplerTest(TestCase):
         sample = sampler.collect(range(n), k)
         self.assertListEqual(list(range(n)), sample)
 
+
+class MainTest(TestCase):
+
+    def test_main_null_terminated(self):
+        items = [b"a b", b"line\nbreak", "caf\u00e9".encode('utf-8'), b"d"]
+        with tempfile.TemporaryDirectory() as tempdir:
+            pathname = os.path.join(tempdir, 'items.bin')
+            with open(pathname, 'wb') as ofile:
+                ofile.write(b"".join(item + b"\0" for item in items))
+            stdout = io.TextIOWrapper(io.BytesIO())
+            with unittest.mock.patch('sys.stdout', stdout):
+                exit_code = ressample.main(['-0', '--preserve-order', '3', pathname])
+        self.assertEqual(0, exit_code)
+        output = stdout.buffer.getvalue()
+        self.assertTrue(output.endswith(b"\0"))
+        sample = output[:-1].split(b"\0")
+        self.assertEqual(3, len(sample))
+        self.assertListEqual([item for item in items if item in sample], sample)
+
+    def test_main_lines(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pathname = os.path.join(tempdir, 'lines.txt')
+            with open(pathname, 'w') as ofile:
+                ofile.write("a\nb\nc\n")
+            stdout = io.StringIO()
+            with unittest.mock.patch('sys.stdout', stdout):
+                exit_code = ressample.main(['5', pathname])
+        self.assertEqual(2, exit_code)
+        self.assertListEqual(["a", "b", "c"], sorted(stdout.getvalue().splitlines()))
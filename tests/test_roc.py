@@ -22,3 +22,20 @@ class ModuleMethodsTest(TestCase):
         curve = roc.roc_transform(elements, domain)
         self.assertEqual(len(curve), domain_size)
 
+    def test_decide_domain_width(self):
+        values = [self.rng.random() for _ in range(500)]
+        domain = list(roc.decide_domain(iter(values), 10))
+        self.assertEqual(10, len(domain))
+        self.assertEqual(min(values), domain[0])
+
+    def test_decide_domain_quantile(self):
+        values = [self.rng.expovariate(10.0) for _ in range(1000)] + [100.0]
+        domain = list(roc.decide_domain(values, 10, mode='quantile'))
+        sorted_values = sorted(values)
+        expected = [sorted_values[(i * len(values)) // 10] for i in range(10)]
+        self.assertListEqual(expected, domain)
+
+    def test_decide_domain_quantile_ties(self):
+        values = [0.0] * 90 + [1.0] * 10
+        domain = list(roc.decide_domain(values, 20, mode='quantile'))
+        self.assertListEqual([0.0, 1.0], domain)